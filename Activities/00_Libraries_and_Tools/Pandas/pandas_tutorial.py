@@ -1,5 +1,6 @@
+from helper_methods import read_csv_cached
+
 import os
-import pandas as pd
 
 # https://pandas.pydata.org/pandas-docs/stable/reference/index.html
 
@@ -76,8 +77,8 @@ import pandas as pd
 
 
 data_folder = "data_files"
-income = pd.read_csv(os.path.join(data_folder, "income.csv"))
-series = pd.read_csv(os.path.join(data_folder, "iris.csv"))
+income = read_csv_cached(os.path.join(data_folder, "income.csv"))
+series = read_csv_cached(os.path.join(data_folder, "iris.csv"))
 
 
 column_names = income.columns
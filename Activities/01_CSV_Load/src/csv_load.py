@@ -2,61 +2,325 @@
 # Instructor: Thyago Mota
 # Description: Activity 01 - CSV Data Load
 
-import mysql.connector 
+from db_backend import open_backend
+
 import csv
 import os
+import queue
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # definitions/parameters
 DATA_FOLDER = os.path.join("..", "data")
 CSV_FILE_NAME = 'employees.csv'
 DB_HOST = 'localhost'
 DB_NAME = 'hr'
+TABLE_NAME = 'Employees'
+COLUMNS = 9             # columns of the Employees table
+BATCH_SIZE = 10000
+WORKERS = 4
+RETRIES = 3
+MODES = ['row', 'bulk', 'infile', 'parallel', 'benchmark']
+
+# same table as files/employees.sql, created on the fly by the sqlite backend
+EMPLOYEES_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+    id     INT PRIMARY KEY,
+    name   VARCHAR(20),
+    gender CHAR(1),
+    email  VARCHAR(40),
+    birth  DATE,
+    start  DATE,
+    salary INT,
+    ssn    VARCHAR(11),
+    phone  VARCHAR(12)
+);
+"""
+
+
+# yields the csv rows in lists of at most batch_size rows, without reading the whole file
+def read_batches(filepath, batch_size=BATCH_SIZE):
+    with open(filepath, newline='') as csvfile:
+        reader = csv.reader(csvfile, delimiter=',', quotechar='"')
+        batch = []
+        for row in reader:
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+# original path: one INSERT (and, under autocommit, one commit) per csv row
+# returns (inserted, rejected)
+def load_rows(backend, db, filepath):
+    cursor = db.cursor()
+    inserted = rejected = 0
+    for batch in read_batches(filepath):
+        for row in batch:
+            try:
+                backend.insert_many(cursor, TABLE_NAME, [row], COLUMNS)
+                db.commit()
+                inserted += 1
+            except backend.row_errors():
+                rejected += 1
+    cursor.close()
+    return inserted, rejected
+
+
+# inserts one batch inside the current transaction and returns the number of rejected rows
+# executemany sends the whole batch as one multi-row INSERT; if the server rejects it,
+# the batch is retried row by row so only the offending rows are lost (and counted)
+def insert_batch(backend, db, cursor, batch):
+    if not batch:
+        return 0
+    try:
+        backend.insert_many(cursor, TABLE_NAME, batch, COLUMNS)
+        return 0
+    except backend.row_errors():
+        db.rollback()
+    rejected = 0
+    for row in batch:
+        try:
+            backend.insert_many(cursor, TABLE_NAME, [row], COLUMNS)
+        except backend.row_errors():
+            rejected += 1
+    return rejected
+
+
+# streams the csv in batches, one explicit transaction per batch
+# returns (inserted, rejected); rejections are also reported per batch
+def load_bulk(backend, db, filepath, batch_size=BATCH_SIZE, verbose=True):
+    cursor = db.cursor()
+    inserted = rejected = 0
+    for number, batch in enumerate(read_batches(filepath, batch_size)):
+        backend.begin(db)
+        batch_rejected = insert_batch(backend, db, cursor, batch)
+        db.commit()
+        inserted += len(batch) - batch_rejected
+        rejected += batch_rejected
+        if batch_rejected and verbose:
+            print(f"batch {number}: {batch_rejected} of {len(batch)} rows rejected.")
+    cursor.close()
+    return inserted, rejected
+
+
+# fast path: the client streams the file to the server, which parses it itself
+# (mysql only: LOAD DATA LOCAL INFILE, see db_backend.MySQLBackend.load_file)
+# returns (inserted, rejected); duplicate keys count as rejected
+def load_infile(backend, db, filepath):
+    with open(filepath, newline='') as csvfile:
+        total = sum(1 for _ in csv.reader(csvfile))
+    inserted = backend.load_file(db, TABLE_NAME, filepath)
+    return inserted, total - inserted
+
+
+# splits a file into at most parts byte ranges (start, end) that begin and end on line boundaries
+def split_file(filepath, parts):
+    size = os.path.getsize(filepath)
+    boundaries = [0]
+    with open(filepath, 'rb') as file:
+        for i in range(1, parts):
+            file.seek(max(size * i // parts, boundaries[-1]))
+            if file.tell() > 0:
+                file.seek(file.tell() - 1)
+                file.readline()         # move past the end of the line we landed in
+            boundaries.append(min(file.tell(), size))
+    boundaries.append(size)
+    return [ (start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end ]
+
+
+# yields the csv rows of one byte range in lists of at most batch_size rows
+# (assumes no quoted field spans several lines, which holds for employees.csv)
+def read_range(filepath, start, end, batch_size=BATCH_SIZE):
+    with open(filepath, 'rb') as file:
+        file.seek(start)
+
+        def lines():
+            while file.tell() < end and (line := file.readline()):
+                yield line.decode('utf-8')
+
+        batch = []
+        for row in csv.reader(lines(), delimiter=',', quotechar='"'):
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+# a fixed set of open connections shared by the worker threads
+# connect is any function that returns a new DB-API connection (e.g. backend.connect)
+class ConnectionPool:
+
+    def __init__(self, connect, size):
+        self.connect = connect
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(connect())
+
+    def get(self):
+        return self.connections.get()
+
+    def put(self, db):
+        self.connections.put(db)
+
+    # swaps a broken connection for a new one
+    def replace(self, db):
+        try:
+            db.close()
+        except Exception:
+            pass
+        return self.connect()
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
+
+
+# drops the rows whose id is already in the table, so a retried batch can't insert a row twice
+# (the previous attempt may have committed before its connection failed)
+def skip_existing(backend, cursor, batch):
+    ids = [ row[0] for row in batch ]
+    cursor.execute(backend.sql(f"SELECT id FROM {TABLE_NAME} WHERE id IN ({', '.join(['%s'] * len(ids))})"), ids)
+    existing = { str(row[0]) for row in cursor.fetchall() }
+    return [ row for row in batch if row[0] not in existing ]
+
+
+# loads one byte range over a pooled connection, one transaction per batch
+# a batch that hits a transient error is retried on a fresh connection; rows found already
+# in the table on a retry are counted as skipped rather than inserted again
+# returns the worker's statistics as a dictionary
+def load_partition(backend, pool, filepath, start, end, batch_size=BATCH_SIZE):
+    stats = { 'start': start, 'end': end, 'inserted': 0, 'rejected': 0, 'skipped': 0, 'failed': 0, 'retries': 0 }
+    begin = time.perf_counter()
+    db = pool.get()
+    try:
+        for batch in read_range(filepath, start, end, batch_size):
+            for attempt in range(RETRIES + 1):
+                try:
+                    cursor = db.cursor()
+                    backend.begin(db)
+                    rows = skip_existing(backend, cursor, batch) if attempt else batch
+                    rejected = insert_batch(backend, db, cursor, rows)
+                    db.commit()
+                    cursor.close()
+                    stats['inserted'] += len(rows) - rejected
+                    stats['rejected'] += rejected
+                    stats['skipped'] += len(batch) - len(rows)
+                    break
+                except backend.transient_errors():
+                    stats['retries'] += 1
+                    time.sleep(0.1 * 2 ** attempt)
+                    db = pool.replace(db)
+            else:
+                stats['failed'] += len(batch)
+    finally:
+        pool.put(db)
+    stats['seconds'] = time.perf_counter() - begin
+    stats['rows_per_second'] = stats['inserted'] / stats['seconds'] if stats['seconds'] else 0
+    return stats
+
+
+# splits the file into one byte range per worker and loads the ranges concurrently
+# returns (inserted, rejected) and the per-worker statistics
+def load_parallel(backend, filepath, workers=WORKERS, batch_size=BATCH_SIZE):
+    ranges = split_file(filepath, workers)
+    pool = ConnectionPool(backend.connect, len(ranges))
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [ executor.submit(load_partition, backend, pool, filepath, start, end, batch_size)
+                        for start, end in ranges ]
+            stats = [ future.result() for future in futures ]
+    finally:
+        pool.close()
+    inserted = sum(s['inserted'] for s in stats)
+    rejected = sum(s['rejected'] + s['failed'] for s in stats)
+    return (inserted, rejected), stats
+
+
+# prints one line of statistics per worker
+def print_worker_stats(stats):
+    print(f"{'worker':<8}{'bytes':>14}{'inserted':>10}{'rejected':>10}{'skipped':>9}{'retries':>9}"
+          f"{'seconds':>10}{'rows/s':>12}")
+    for worker, s in enumerate(stats):
+        print(f"{worker:<8}{s['end'] - s['start']:>14}{s['inserted']:>10}{s['rejected'] + s['failed']:>10}"
+              f"{s['skipped']:>9}{s['retries']:>9}{s['seconds']:>10.2f}{s['rows_per_second']:>12.0f}")
+
+
+# empties the table, then times each loader on the same file (infile only runs on mysql)
+# returns a list of (mode, inserted, rejected, seconds, rows per second)
+def benchmark(backend, db, filepath, modes=('row', 'bulk', 'infile', 'parallel')):
+    results = []
+    for mode in modes:
+        if mode == 'infile' and backend.name != 'mysql':
+            continue
+        cursor = db.cursor()
+        cursor.execute(f"DELETE FROM {TABLE_NAME}")
+        db.commit()
+        cursor.close()
+
+        start = time.perf_counter()
+        if mode == 'parallel':
+            (inserted, rejected), _ = load_parallel(backend, filepath)
+        else:
+            inserted, rejected = LOADERS[mode](backend, db, filepath)
+        seconds = time.perf_counter() - start
+        results.append((mode, inserted, rejected, seconds, inserted / seconds if seconds else 0))
+    return results
+
+
+LOADERS = {
+    'row': load_rows,
+    'bulk': load_bulk,
+    'infile': load_infile
+}
+
 
 if __name__ == "__main__":
-    DATA_FOLDER = os.path.join("..", "data")
-    print(DATA_FOLDER)
-    print(os.path.exists(DATA_FOLDER))
-    quit()
 
-    # TODO: get db connection parameters
-    db_user   = os.getenv('db_user')
-    db_passwd = os.getenv('db_pass')
+    # usage: csv_load.py [row|bulk|infile|parallel|benchmark] (default: bulk)
+    # set db_backend=sqlite (and optionally db_path) to load into a local sqlite file instead of mysql
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'bulk'
+    if mode not in MODES:
+        print(f"Unknown mode '{mode}'. Choose one of: {', '.join(MODES)}")
+        exit()
 
     try:
-        # TODO: connect to db
-        db = mysql.connector.connect(
+        # connect to the db (credentials come from db_user/db_pass)
+        backend = open_backend(
             host=DB_HOST,
             database=DB_NAME,
-            user=db_user,
-            password=db_passwd,
-            autocommit=True
+            schema=EMPLOYEES_SCHEMA,
+            allow_local_infile=mode in ('infile', 'benchmark')
         )
+        db = backend.connect()
         # print('DB connection successful!')
 
-        # TODO: check if csv file exists
+        # check if the csv file exists
         filepath = os.path.join(DATA_FOLDER, CSV_FILE_NAME)
 
         if not os.path.exists(filepath):
             print("File not found:  " + filepath)
             exit()
 
-        # TODO: process csv file
-        cursor = db.cursor()
-        count = 0
-        sql = "INSERT INTO Employees " \
-              "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
-
-        with open(filepath, newline='') as csvfile:
-            reader = csv.reader(csvfile, delimiter=',', quotechar='"')
-            for row in reader:
-                try:
-                    cursor.execute(sql, row)
-                    count += 1
-                except Exception as e:
-                    pass
+        # load the csv file
+        if mode == 'benchmark':
+            print(f"{'mode':<8}{'inserted':>10}{'rejected':>10}{'seconds':>10}{'rows/s':>12}")
+            for name, inserted, rejected, seconds, rate in benchmark(backend, db, filepath):
+                print(f"{name:<8}{inserted:>10}{rejected:>10}{seconds:>10.2f}{rate:>12.0f}")
+        elif mode == 'parallel':
+            (inserted, rejected), stats = load_parallel(backend, filepath)
+            print_worker_stats(stats)
+            print(f"{inserted} rows inserted, {rejected} rows rejected.")
+        else:
+            inserted, rejected = LOADERS[mode](backend, db, filepath)
+            print(f"{inserted} rows inserted, {rejected} rows rejected.")
 
-        print(f"{count} rows inserted.")
+        db.close()
 
     except Exception as error:
         print(error)
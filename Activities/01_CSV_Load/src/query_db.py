@@ -1,18 +1,8 @@
-import mysql.connector
-import os
+from db_backend import open_backend
 
-db = mysql.connector.connect(
-  host="localhost",
-  database="hr",
-  user=os.getenv("db_user"),
-  password=os.getenv("db_user")
-)
+backend = open_backend(host="localhost", database="hr")
+db = backend.connect()
 
-cursor = db.cursor()
-cursor.execute("SELECT COUNT(*) FROM employees")
-
-result = cursor.fetchall()
-for x in result:
-  print(str(x[0]) + " rows")
+print(str(backend.count(db, "employees")) + " rows")
 
 db.close()
@@ -6,20 +6,42 @@
 # Developed on Windows 10 Pro, Version 2004, Build 19041.1165
 # Structure is provided for cross-platform compatibility but has not yet been tested
 
+# Usage: export_data.py [client|server] [--gzip] [--parts N | --incremental id|checksum] [--verify]
+#   client (default): rows are streamed to this machine through a server-side cursor
+#                     and written to data/ (no FILE privilege or open folder needed)
+#   server:           SELECT ... INTO OUTFILE, written by the MySQL server on its own host
+#   --incremental id:       append only the rows whose id is above the last run's high-water mark
+#   --incremental checksum: keep one file per id partition (employees.bucketN.csv) and rewrite only
+#                           the partitions whose row checksum or file changed since the last run
+#   --verify:               check that the exported files hold exactly the rows of a full export
+
+from db_backend import open_backend
+
+import argparse
+import csv
+import gzip
+import hashlib
+import io
+import json
 import platform
 import os
-import mysql.connector
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 folder = "data"
 file = "employees.csv"
 
 db_table = 'employees'
+db_key = 'id'
 db_host = "localhost"
 db_name = "hr"
 db_restricted_user = 'hr_admin'
-db_user = os.getenv("db_user")
-db_pass = os.getenv("db_pass")
+
+batch_size = 10000
+partition_width = 100000    # ids per partition file in checksum mode
+state_suffix = '.state.json'
+write_buffer = 1 << 20      # bytes buffered by the csv writer between writes
 
 
 def quit_msg(msg, error):
@@ -28,61 +50,178 @@ def quit_msg(msg, error):
     quit()
 
 
-if __name__ == "__main__":
+# opens a csv file for writing (mode 'w') or appending (mode 'a'), gzip-compressed when the name ends in .gz
+def open_output(filepath, mode='w'):
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, mode + 't', newline='', compresslevel=6)
+    return open(filepath, mode, newline='', buffering=write_buffer)
 
-    system = platform.system()
-    filepath = os.path.join(os.path.join(os.getcwd(), folder, file))
 
-    # Adjust commands for operating system
-    CREATE_FOLDER = f"mkdir {folder}"
+# streams the rows of a select into a csv file batch by batch, so memory stays flat
+# returns (rows, seconds)
+def export_query(backend, db, sql, filepath, params=(), mode='w'):
+    start = time.perf_counter()
+    with open_output(filepath, mode) as output:
+        rows = backend.export_csv(db, sql, output, params, batch_size)
+    return rows, time.perf_counter() - start
 
-    if system == "Windows":
-        FULL_ACCESS = f"CACLS {folder} /E /G Everyone:F"
-        DELETE_FILE = f"del /f {filepath}"
 
+# splits the key range of a table into at most parts [low, high) ranges of equal width
+def key_ranges(backend, db, table, key, parts):
+    cursor = db.cursor()
+    cursor.execute(f"SELECT MIN({key}), MAX({key}) FROM {table}")
+    low, high = cursor.fetchone()
+    cursor.close()
+    if low is None:
+        return []
+    step = max((high - low + 1) // parts, 1)
+    bounds = list(range(low, high + 1, step))[:parts] + [high + 1]
+    return list(zip(bounds, bounds[1:]))
+
+
+# exports one key range over its own connection; returns the part's statistics
+def export_part(backend, table, key, low, high, filepath):
+    db = backend.connect()
+    try:
+        sql = f"SELECT * FROM {table} WHERE {key} >= %s AND {key} < %s"
+        rows, seconds = export_query(backend, db, sql, filepath, (low, high))
+    finally:
+        db.close()
+    return {'file': filepath, 'low': low, 'high': high, 'rows': rows, 'seconds': seconds}
+
+
+# writes the table to parts files concurrently, one primary-key range per file
+# returns the statistics of every part
+def export_partitioned(backend, db, table, key, filepath, parts):
+    ranges = key_ranges(backend, db, table, key, parts)
+    with ThreadPoolExecutor(max_workers=max(len(ranges), 1)) as executor:
+        futures = [executor.submit(export_part, backend, table, key, low, high, part_file(filepath, i))
+                   for i, (low, high) in enumerate(ranges)]
+        return [future.result() for future in futures]
+
+
+# returns the name of a numbered part of the output file: data/employees.csv -> data/employees.part3.csv
+# (label names the kind of part: --parts files are 'part', checksum partitions 'bucket')
+def part_file(filepath, number, label='part'):
+    directory, name = os.path.split(filepath)
+    name, extension = name.split('.', 1)
+    return os.path.join(directory, f"{name}.{label}{number}.{extension}")
+
+
+# returns the state saved by the last incremental run, or None
+def read_state(filepath):
+    if not os.path.exists(filepath + state_suffix):
+        return None
+    with open(filepath + state_suffix) as state_file:
+        return json.load(state_file)
+
+
+# saves the state next to the output; written to a temporary file first so a crash can't corrupt it
+def write_state(filepath, state):
+    temporary = filepath + state_suffix + '.tmp'
+    with open(temporary, 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(temporary, filepath + state_suffix)
+
+
+# appends the rows above the last high-water mark (all rows on the first run) to a single file
+# suits append-only tables: updated or deleted rows are not detected
+# the new mark is read before the export, which stops at it, so rows inserted meanwhile are left to the next run
+# returns (rows written, files, new state)
+def export_new_rows(backend, db, table, key, filepath, state):
+    high_water = state.get('high_water') if state and state.get('strategy') == 'id' else None
+    cursor = db.cursor()
+    cursor.execute(f"SELECT MAX({key}) FROM {table}")
+    max_key = cursor.fetchone()[0]
+    cursor.close()
+
+    if high_water is None or not os.path.exists(filepath):
+        sql = f"SELECT * FROM {table} WHERE {key} <= %s ORDER BY {key}"
+        rows, _ = export_query(backend, db, sql, filepath, (max_key,))
     else:
-        FULL_ACCESS = f"chmod 777 {folder}"
-        DELETE_FILE = f"rm {filepath}"
+        sql = f"SELECT * FROM {table} WHERE {key} > %s AND {key} <= %s ORDER BY {key}"
+        rows, _ = export_query(backend, db, sql, filepath, (high_water, max_key), mode='a')
+    return rows, [filepath], {'strategy': 'id', 'high_water': high_water if max_key is None else max_key}
 
-    if system not in ["Windows", "Linux", "Darwin"]:
-        print(f"Warning: This program isn't compatible with {system}. "
-              f"File output may not be saved correctly.")
 
+# rewrites only the partition files whose (row count, checksum) changed since the last run,
+# or whose file no longer has the size it was written with, and deletes the files of partitions
+# that are now empty; partition files are named employees.bucketN.csv, apart from the --parts files
+# returns (rows written, files, new state)
+def export_changed_partitions(backend, db, table, key, filepath, state, width=partition_width):
+    current = backend.checksums(db, table, key, width)
+    previous = {}
+    if state and state.get('strategy') == 'checksum' and state.get('width') == width:
+        previous = {int(bucket): value for bucket, value in state['partitions'].items()}
 
-    # Establish db connection; quit on failure
-    try:
-        db = mysql.connector.connect(
-            host=db_host,
-            database=db_name,
-            user=db_user,
-            password=db_pass
-        )
-
-        sql = f"GRANT FILE ON *.* TO {db_restricted_user}"
-        cursor = db.cursor()
-        cursor.execute(sql)
+    rows = 0
+    partitions = {}
+    for bucket, value in sorted(current.items()):
+        bucket_path = part_file(filepath, bucket, 'bucket')
+        on_disk = list(value) + ([os.path.getsize(bucket_path)] if os.path.exists(bucket_path) else [])
+        if previous.get(bucket) != on_disk:
+            sql = f"SELECT * FROM {table} WHERE {key} >= %s AND {key} < %s"
+            count, _ = export_query(backend, db, sql, bucket_path, (bucket * width, (bucket + 1) * width))
+            rows += count
+        partitions[str(bucket)] = list(value) + [os.path.getsize(bucket_path)]
+    for bucket in previous.keys() - current.keys():
+        if os.path.exists(part_file(filepath, bucket, 'bucket')):
+            os.remove(part_file(filepath, bucket, 'bucket'))
 
+    files = [part_file(filepath, bucket, 'bucket') for bucket in sorted(current)]
+    return rows, files, {'strategy': 'checksum', 'width': width, 'partitions': partitions}
 
-    except Exception as error:
-        quit_msg("Couldn't connect to database", error)
 
+# order-independent digest of csv lines: (line count, sum of the lines' md5 values)
+def digest_lines(lines):
+    count = total = 0
+    for line in lines:
+        count += 1
+        total += int.from_bytes(hashlib.md5(line.encode('utf-8')).digest(), 'big')
+    return count, total % (1 << 128)
 
-    # Create Destination folder with open permissions
-    if not os.path.exists(folder):
-        os.system(CREATE_FOLDER)
-        os.system(FULL_ACCESS)
 
+# yields the lines a full export of the table would write, without writing them
+def table_lines(backend, db, table):
+    line = io.StringIO()
+    writer = csv.writer(line, lineterminator='\n')
+    for batch in backend.stream(db, f"SELECT * FROM {table}", batch_size=batch_size):
+        for row in batch:
+            line.seek(0)
+            line.truncate()
+            writer.writerow(row)
+            yield line.getvalue()
 
-    # Verify that folder was created, quit otherwise
-    if not os.path.exists(folder):
-        quit_msg("Could not create folder with full access.", None)
 
+# yields the lines of the exported files
+def file_lines(files):
+    for filepath in files:
+        with (gzip.open(filepath, 'rt', newline='') if filepath.endswith('.gz') else open(filepath, newline='')) as file:
+            yield from file
 
-    # If a csv file already exists, delete it
-    if os.path.exists(filepath):
-        os.system(DELETE_FILE)
 
-    # Retrieve SQL data and save to file
+# True if the exported files hold exactly the rows of a full export, in any order
+def verify_export(backend, db, table, files):
+    return digest_lines(file_lines(files)) == digest_lines(table_lines(backend, db, table))
+
+
+# original path: the MySQL server writes the file itself (needs the FILE privilege and an open folder)
+def export_server(db, cursor, filepath):
+    system = platform.system()
+
+    if system == "Windows":
+        full_access = f"CACLS {folder} /E /G Everyone:F"
+    else:
+        full_access = f"chmod 777 {folder}"
+
+    if system not in ["Windows", "Linux", "Darwin"]:
+        print(f"Warning: This program isn't compatible with {system}. "
+              f"File output may not be saved correctly.")
+
+    sql = f"GRANT FILE ON *.* TO {db_restricted_user}"
+    cursor.execute(sql)
+    os.system(full_access)
+
     outfile = filepath.replace("\\", "/")
     sql = f" \
         SELECT * FROM {db_table} \
@@ -92,14 +231,74 @@ if __name__ == "__main__":
 
     cursor.execute(sql)
 
-    cursor.execute(f"SELECT COUNT(*) FROM {db_table}")
-    result = cursor.fetchall()
-    rowcount = result[0][0]
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Export the employees table to csv.")
+    parser.add_argument('mode', nargs='?', choices=['client', 'server'], default='client')
+    parser.add_argument('--gzip', action='store_true', help="compress the output (client mode)")
+    parser.add_argument('--parts', type=int, default=1, help="split the output into N files by key range (client mode)")
+    parser.add_argument('--incremental', choices=['id', 'checksum'], help="export only new or changed rows (client mode)")
+    parser.add_argument('--verify', action='store_true', help="compare the exported files with a full export")
+    args = parser.parse_args()
+
+    filepath = os.path.join(os.getcwd(), folder, file + ('.gz' if args.gzip else ''))
+
+
+    # Establish db connection (db_backend, db_user, db_pass env variables); quit on failure
+    try:
+        backend = open_backend(host=db_host, database=db_name)
+        db = backend.connect()
+        cursor = db.cursor()
+
+    except Exception as error:
+        quit_msg("Couldn't connect to database", error)
+
+    if args.mode == 'server' and backend.name != 'mysql':
+        quit_msg("Server-side export needs the mysql backend.", backend.name)
+
+
+    # Create destination folder
+    os.makedirs(folder, exist_ok=True)
+
+
+    # If a csv file already exists, delete it (incremental runs update the previous output instead)
+    if os.path.exists(filepath) and not args.incremental:
+        os.remove(filepath)
+
+    # Retrieve SQL data and save to file
+    start = time.perf_counter()
+    if args.mode == 'server':
+        export_server(db, cursor, filepath)
+        rowcount = backend.count(db, db_table)
+        files = [filepath]
+
+    elif args.incremental:
+        export = export_new_rows if args.incremental == 'id' else export_changed_partitions
+        rowcount, files, state = export(backend, db, db_table, db_key, filepath, read_state(filepath))
+        write_state(filepath, state)
+
+    elif args.parts > 1:
+        parts = export_partitioned(backend, db, db_table, db_key, filepath, args.parts)
+        for part in parts:
+            print(f"{os.path.basename(part['file'])}: {part['rows']} records "
+                  f"({part['rows'] / part['seconds'] if part['seconds'] else 0:.0f} rows/s)")
+        rowcount = sum(part['rows'] for part in parts)
+        files = [part['file'] for part in parts]
+
+    else:
+        rowcount, _ = export_query(backend, db, f"SELECT * FROM {db_table}", filepath)
+        files = [filepath]
+    seconds = time.perf_counter() - start
+
+    if args.verify:
+        print("Verification", "passed." if verify_export(backend, db, db_table, files) else "FAILED.")
 
     db.close()
 
-    # Verify that folder was created
-    if not os.path.exists(filepath):
-        quit_msg(f"File was not created.")
+    # Verify that the files were created
+    if not all(os.path.exists(f) for f in files):
+        quit_msg("File was not created.", filepath)
     else:
-        print(f"Exported {rowcount} records to {file}.")
+        print(f"Exported {rowcount} records to {', '.join(os.path.basename(f) for f in files)} "
+              f"in {seconds:.2f}s ({rowcount / seconds if seconds else 0:.0f} rows/s).")
@@ -3,20 +3,45 @@
 # Description: Activity 03 - Quotes API
 
 
-import requests
+import sys
+from datetime import datetime, timedelta
 from helper_methods import *
 
 
 # definitions/parameters
 DATA_FOLDER = os.path.join('..', 'data')
-JSON_FILE_NAME = 'quotes.json'
+JSON_FILE_NAME = 'quotes.jsonl'            # one quote per line, appended on every run
+LEGACY_JSON_FILE_NAME = 'quotes.json'      # earlier format: a single JSON array
 QUOTES_API_URL = 'http://quotes.rest/qod'
 
 
+# converts the earlier single-array quotes.json into the JSON Lines store (once)
+# the store is written to a temporary file and moved into place, so a crash can't leave it half migrated
+def migrate_legacy_file(legacy_file, quotes_file):
+    if file_exists(legacy_file) and not file_exists(quotes_file):
+        temporary = quotes_file + '.tmp'
+        with open(temporary, 'w', encoding='utf-8', newline='\n') as file:
+            for quote in json_read_from_file(legacy_file):
+                file.write(json.dumps(quote, separators=(',', ':')) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, quotes_file)
+        os.rename(legacy_file, legacy_file + '.bak')
+
+
 if __name__ == "__main__":
 
+    # usage: quotes_api.py [compact]
+    #   compact: drop repeated quotes of the same date from the store instead of fetching
+    quotes_file = os.path.join(DATA_FOLDER, JSON_FILE_NAME)
+    if len(sys.argv) > 1 and sys.argv[1] == 'compact':
+        print(jsonl_compact(quotes_file, 'date'), "quotes kept.")
+        quit()
+
     # TODO: send the request to the API and process the response
-    result = requests.get(QUOTES_API_URL)
+    # the quote changes once a day, so the response is cached until midnight
+    midnight = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    result = cached_get(QUOTES_API_URL, ttl=(midnight - datetime.now()).total_seconds())
     if result.status_code != 200:
         quit_msg("Failed to retrieve content.", f"Code {result.status_code}")
     raw_json = json.loads(result.content.decode('utf-8'))
@@ -34,11 +59,11 @@ if __name__ == "__main__":
     if not os.path.exists(DATA_FOLDER):
         os.mkdir(DATA_FOLDER)
 
-    quotes_file = os.path.join(DATA_FOLDER, JSON_FILE_NAME)
-    if file_exists(quotes_file):
-        quotes = json_read_from_file(quotes_file)
-    else:
-        quotes = []
-
-    quotes.append(new_quote)
-    json_write_to_file(quotes, quotes_file)
+    migrate_legacy_file(os.path.join(DATA_FOLDER, LEGACY_JSON_FILE_NAME), quotes_file)
+    # skip the quote if the store already ends with it (the cached response alone says nothing
+    # about whether an earlier run got to append it)
+    last_quote = jsonl_last(quotes_file)
+    if last_quote and last_quote.get('date') == new_quote['date']:
+        print("Today's quote was already saved.")
+        quit()
+    jsonl_append(new_quote, quotes_file)
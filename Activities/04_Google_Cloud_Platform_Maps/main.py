@@ -1,6 +1,6 @@
-import requests
+from helper_methods import cached_get
+
 import os
-from urllib.parse import urlencode
 
 # definitions/parameters
 STATIC_MAPS_API_URL = 'https://maps.googleapis.com/maps/api/staticmap'
@@ -8,27 +8,25 @@ LOCATION_TO_MAP = 'Metropolitan State University of Denver'
 ZOOM = '15'
 SIZE = '800x600'
 IMAGE_FILE_NAME = 'msudenver.png'
+IMAGE_TTL = 30 * 24 * 60 * 60       # seconds a fetched map image is reused
 
 # requirements: API_KEY environment variable
 if __name__ == "__main__":
 
-    # encode URL
+    # query parameters
     params = {
         'center': LOCATION_TO_MAP,
         'zoom': ZOOM,
         'size': SIZE,
         'key': os.getenv('Google_API_Key')
     }
-    url = STATIC_MAPS_API_URL + '?' + urlencode(params)
 
-    # make the API call and save the result as a png image
-    result = requests.get(url)
+    # make the API call (or reuse a recent result) and save the result as a png image
+    result = cached_get(STATIC_MAPS_API_URL, params, ttl=IMAGE_TTL)
     if result.status_code == 200:
         with open(IMAGE_FILE_NAME, 'wb') as image:
             image.write(result.content)
         print('Map image saved in ' + IMAGE_FILE_NAME)
     else:
-        print(result)
-
-        for i in result:
-            print(i)
+        print(result.status_code)
+        print(result.text)
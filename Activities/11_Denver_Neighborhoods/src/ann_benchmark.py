@@ -0,0 +1,69 @@
+# CS390Z - Introduction to Data Mining - Fall 2021
+# Instructor: Thyago Mota
+# Description: Activity 11: benchmark of the IVF index against the exact top-k search (build time, latency, recall@k)
+
+from ann_index import IVFIndex, recall_at_k
+from distances import top_k
+
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+# definitions/parameters
+ROWS = 200000
+COLUMNS = 5             # same number of features as denver_neighborhoods.csv
+QUERIES = 1000
+K = 10
+NPROBES = [1, 2, 4, 8, 16, 32]
+SEED = 390
+
+
+if __name__ == "__main__":
+
+    # usage: ann_benchmark.py [rows] [k]
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else K
+    rng = np.random.default_rng(SEED)
+
+    # normalized features: clusters of "similar neighborhoods" plus uniform noise
+    centers = rng.random((max(rows // 1000, 1), COLUMNS))
+    X = np.clip(centers[rng.integers(len(centers), size=rows)] + rng.normal(0, 0.05, (rows, COLUMNS)), 0, 1)
+    noise = rng.random(rows) < 0.1
+    X[noise] = rng.random((noise.sum(), COLUMNS))
+    queries = rng.random((QUERIES, COLUMNS))
+
+    start = time.perf_counter()
+    index = IVFIndex.build(X, seed=SEED)
+    build = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as folder:
+        filepath = os.path.join(folder, 'index.npz')
+        start = time.perf_counter()
+        index.save(filepath)
+        save = time.perf_counter() - start
+        start = time.perf_counter()
+        index = IVFIndex.load(filepath)
+        load = time.perf_counter() - start
+        size = os.path.getsize(filepath)
+
+    start = time.perf_counter()
+    exact, _ = top_k(X, k, queries=queries)
+    exact_ms = (time.perf_counter() - start) * 1000 / QUERIES
+
+    print(f"{rows} rows x {COLUMNS} columns, {len(index.centroids)} lists, {QUERIES} queries, k={k}")
+    print(f"build {build:.2f}s, save {save:.2f}s, load {load:.2f}s, {size / 2 ** 20:.1f} MB")
+    print(f"exact top_k: {exact_ms:.3f} ms/query")
+    print(f"{'nprobe':>8}{'ms/query':>10}{'p99 ms':>10}{'recall@k':>10}")
+    for nprobe in NPROBES:
+        latencies = []
+        approximate = []
+        for query in queries:
+            start = time.perf_counter()
+            ids, _ = index.query(query, k, nprobe)
+            latencies.append(time.perf_counter() - start)
+            approximate.append(ids)
+        latencies = np.array(latencies) * 1000
+        print(f"{nprobe:>8}{latencies.mean():>10.3f}{np.percentile(latencies, 99):>10.3f}"
+              f"{recall_at_k(approximate, exact):>10.3f}")
@@ -0,0 +1,114 @@
+# CS390Z - Introduction to Data Mining - Fall 2021
+# Instructor: Thyago Mota
+# Description: Activity 11: approximate nearest neighbors with an inverted file (IVF) over k-means centroids
+
+from distances import top_k
+
+import numpy as np
+
+# definitions/parameters
+INDEX_FILE_VERSION = 1
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLE = 64      # training rows per centroid; k-means on a sample is enough to place the centroids
+NPROBE = 8              # lists scanned per query; more lists = better recall, slower queries
+
+
+# index of the nearest centroid of every row of X
+def nearest_centroid(X, centroids):
+    indices, _ = top_k(centroids, 1, queries=X)
+    return indices[:, 0]
+
+
+# Lloyd's k-means; empty clusters restart at random rows
+def kmeans(X, clusters, iterations=KMEANS_ITERATIONS, seed=None):
+    rng = np.random.default_rng(seed)
+    centroids = X[rng.choice(len(X), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest_centroid(X, centroids)
+        counts = np.bincount(labels, minlength=clusters)
+        sums = np.column_stack([np.bincount(labels, weights=X[:, j], minlength=clusters) for j in range(X.shape[1])])
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = X[rng.choice(len(X), empty.sum())]
+    return centroids
+
+
+# Inverted file index: the rows are grouped by nearest centroid and stored contiguously per group (list),
+# so a query only scans the nprobe lists whose centroids are closest to it
+class IVFIndex:
+
+    # list i holds vectors[offsets[i]:offsets[i + 1]], whose original row numbers are ids[offsets[i]:offsets[i + 1]]
+    def __init__(self, centroids, offsets, ids, vectors, labels=None):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.ids)
+
+    # lists defaults to about sqrt(n), which keeps both the centroid scan and the list scans short
+    @classmethod
+    def build(cls, X, lists=None, iterations=KMEANS_ITERATIONS, seed=None, labels=None):
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        lists = min(lists or max(1, int(np.sqrt(len(X)))), len(X))
+        rng = np.random.default_rng(seed)
+        sample = X[rng.choice(len(X), min(len(X), lists * KMEANS_SAMPLE), replace=False)]
+        centroids = kmeans(sample, lists, iterations, seed)
+
+        assignment = nearest_centroid(X, centroids)
+        ids = np.argsort(assignment, kind='stable')
+        offsets = np.zeros(lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=lists), out=offsets[1:])
+        labels = None if labels is None else np.asarray(labels).astype(str)
+        return cls(centroids, offsets, ids, X[ids], labels)
+
+    # builds the index over the rows of a (normalized) DataFrame, labeled by its index
+    @classmethod
+    def from_dataframe(cls, df, **options):
+        return cls.build(df.values, labels=df.index.values, **options)
+
+    # the (approximately) k nearest rows to a single vector: (row numbers, euclidean distances), nearest first
+    def query(self, vector, k, nprobe=NPROBE):
+        vector = np.asarray(vector, dtype=np.float64)
+        to_centroids = ((self.centroids - vector) ** 2).sum(axis=1)
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(to_centroids, nprobe - 1)[:nprobe] if nprobe < len(self.centroids) else range(nprobe)
+
+        slices = [slice(self.offsets[i], self.offsets[i + 1]) for i in probes]
+        candidates = np.concatenate([self.vectors[s] for s in slices])
+        candidate_ids = np.concatenate([self.ids[s] for s in slices])
+        squares = ((candidates - vector) ** 2).sum(axis=1)
+        k = min(k, len(squares))
+        nearest = np.argpartition(squares, k - 1)[:k] if k < len(squares) else np.arange(len(squares))
+        nearest = nearest[np.argsort(squares[nearest], kind='stable')]
+        return candidate_ids[nearest], np.sqrt(squares[nearest])
+
+    # labels of the (approximately) k nearest rows to a vector, with their distances
+    def query_labels(self, vector, k, nprobe=NPROBE):
+        ids, distances = self.query(vector, k, nprobe)
+        return list(zip(self.labels[ids].tolist(), distances.tolist()))
+
+    # written uncompressed so loading is a plain read of the arrays
+    def save(self, filepath):
+        arrays = dict(version=np.array([INDEX_FILE_VERSION]), centroids=self.centroids, offsets=self.offsets,
+                      ids=self.ids, vectors=self.vectors)
+        if self.labels is not None:
+            arrays['labels'] = self.labels
+        with open(filepath, 'wb') as file:
+            np.savez(file, **arrays)
+
+    @classmethod
+    def load(cls, filepath):
+        with np.load(filepath) as arrays:
+            if 'version' not in arrays or arrays['version'][0] != INDEX_FILE_VERSION:
+                raise ValueError(f"'{filepath}' is not an index file.")
+            labels = arrays['labels'] if 'labels' in arrays else None
+            return cls(arrays['centroids'], arrays['offsets'], arrays['ids'], arrays['vectors'], labels)
+
+
+# share of the exact k nearest neighbors found by the approximate search, averaged over the queries
+def recall_at_k(approximate, exact):
+    found = sum(len(np.intersect1d(a, e)) for a, e in zip(approximate, exact))
+    return found / exact.size
@@ -0,0 +1,104 @@
+# CS390Z - Introduction to Data Mining - Fall 2021
+# Instructor: Thyago Mota
+# Description: Activity 11: local fixture site for the crawler; checks that re-crawls only download changed pages
+
+from helper_methods import HttpCache
+import scraper
+
+import hashlib
+import sys
+import tempfile
+import threading
+import time
+import os
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# definitions/parameters
+PAGES = 50
+LATENCY = 0.05          # seconds the fixture takes to answer each request
+CHANGED = 5             # pages edited between the second and third crawl
+
+
+# the fixture site: an index table linking to every neighborhood page; pages[name] = (body, last modified)
+class FixtureSite:
+
+    def __init__(self, pages):
+        self.pages = {}
+        self.lock = threading.Lock()
+        self.requests = {200: 0, 304: 0}
+        for i in range(pages):
+            self.edit(f"neighborhood-{i}")
+
+    def edit(self, name):
+        body = f"<html><body><h1>{name}</h1><p>edited {time.time()}</p></body></html>"
+        self.pages[name] = (body.encode('utf-8'), time.time())
+
+    def index(self):
+        rows = ''.join(f"<tr><td><a href='/neighborhoods/{name}/'>{name}</a></td><td>{i * 1000}</td></tr>"
+                       for i, name in enumerate(self.pages))
+        body = f"<html><body><table><tr><th>Neighborhood</th><th>Population</th></tr>{rows}</table></body></html>"
+        return body.encode('utf-8'), 0
+
+
+def handler(site):
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            time.sleep(LATENCY)
+            name = self.path.strip('/').rsplit('/', 1)[-1]
+            if self.path.strip('/') == 'neighborhoods':
+                body, modified = site.index()
+            elif name in site.pages:
+                body, modified = site.pages[name]
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            status = 304 if self.headers.get('If-None-Match') == etag else 200
+            with site.lock:
+                site.requests[status] += 1
+            self.send_response(status)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', formatdate(modified, usegmt=True))
+            self.send_header('Content-Length', str(len(body) if status == 200 else 0))
+            self.end_headers()
+            if status == 200:
+                self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FixtureHandler
+
+
+if __name__ == "__main__":
+
+    # usage: crawler_fixture.py [number of pages]
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else PAGES
+    site = FixtureSite(pages)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler(site))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/neighborhoods/"
+
+    with tempfile.TemporaryDirectory() as folder:
+        scraper.PAGES_FOLDER = os.path.join(folder, 'pages')
+        cache = HttpCache(os.path.join(folder, 'cache.sqlite3'))
+        print(f"{pages} pages, {LATENCY * 1000:.0f} ms latency, {scraper.WORKERS} workers, no politeness delay")
+        print(f"{'crawl':<22}{'downloaded':>11}{'304':>6}{'seconds':>9}")
+        for name, edits in [('first', 0), ('unchanged', 0), (f"{CHANGED} pages edited", CHANGED)]:
+            for page in list(site.pages)[:edits]:
+                site.edit(page)
+            site.requests = {200: 0, 304: 0}
+            start = time.perf_counter()
+            results = scraper.crawl(base_url, delay=0, cache=cache)
+            seconds = time.perf_counter() - start
+            downloaded = sum(result[2] for result in results)
+            print(f"{name:<22}{downloaded:>11}{site.requests[304]:>6}{seconds:>9.2f}")
+            assert len(results) == pages and len(os.listdir(scraper.PAGES_FOLDER)) == pages
+            assert downloaded == (pages if name == 'first' else edits)
+
+    server.shutdown()
@@ -0,0 +1,140 @@
+# CS390Z - Introduction to Data Mining - Fall 2021
+# Instructor: Thyago Mota
+# Description: Activity 11: vectorized pairwise distances between the rows of a matrix
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# definitions/parameters
+METRICS = ['euclidean', 'cosine', 'manhattan']
+BLOCK_SIZE = 1024       # rows per block; a block of distances is BLOCK_SIZE x n
+TILE_ELEMENTS = 1 << 24 # distances per top_k tile (128 MB), unless a block size is given
+
+
+# squared euclidean distances between the rows of A and B with the ||a||² + ||b||² - 2ab trick
+# (one matrix product, done by BLAS); rounding can leave tiny negatives, which are clipped to 0
+def squared_euclidean_blas(A, B):
+    squares = A @ B.T
+    squares *= -2
+    squares += (A * A).sum(axis=1)[:, None]
+    squares += (B * B).sum(axis=1)[None, :]
+    return np.maximum(squares, 0, out=squares)
+
+
+# squared euclidean distances accumulated one column at a time, in the same order as a python loop
+# over the columns, so every entry is bit-for-bit the sum eucl_dist computes
+def squared_euclidean_exact(A, B):
+    squares = np.zeros((len(A), len(B)))
+    for k in range(A.shape[1]):
+        squares += (A[:, k, None] - B[None, :, k]) ** 2
+    return squares
+
+
+# manhattan distances accumulated one column at a time
+def manhattan(A, B):
+    distances = np.zeros((len(A), len(B)))
+    for k in range(A.shape[1]):
+        distances += np.abs(A[:, k, None] - B[None, :, k])
+    return distances
+
+
+# cosine distances (1 - cosine similarity); all-zero rows are at distance 1 from everything
+def cosine(A, B):
+    a_norms = np.linalg.norm(A, axis=1)
+    b_norms = np.linalg.norm(B, axis=1)
+    a_norms[a_norms == 0] = np.inf
+    b_norms[b_norms == 0] = np.inf
+    return 1 - (A @ B.T) / a_norms[:, None] / b_norms[None, :]
+
+
+# distances between the rows of A and the rows of B
+# exact only matters for euclidean: it trades the BLAS product for column-by-column accumulation
+def distance_block(A, B, metric='euclidean', exact=False):
+    if metric == 'euclidean':
+        return np.sqrt(squared_euclidean_exact(A, B) if exact else squared_euclidean_blas(A, B))
+    if metric == 'cosine':
+        return cosine(A, B)
+    if metric == 'manhattan':
+        return manhattan(A, B)
+    raise ValueError(f"Unknown metric '{metric}'. Choose one of: {', '.join(METRICS)}")
+
+
+# fills the n x n matrix function(rows, rows) for the rows of X, for a symmetric function
+# only the blocks on and above the diagonal are computed; the rest is mirrored from them
+def symmetric_matrix(X, function, block_size=BLOCK_SIZE):
+    n = len(X)
+    matrix = np.empty((n, n))
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        block = function(X[start:end], X[start:])
+        matrix[start:end, start:] = block
+        matrix[start:, start:end] = block.T
+    return matrix
+
+
+# full n x n distance matrix between the rows of X
+def pairwise_distances(X, metric='euclidean', exact=False, block_size=BLOCK_SIZE):
+    X = np.asarray(X, dtype=np.float64)
+    distances = symmetric_matrix(X, lambda A, B: distance_block(A, B, metric, exact), block_size)
+    if metric == 'euclidean' and not exact:
+        np.fill_diagonal(distances, 0)
+    return distances
+
+
+# the similarity eucl_dist computes, for every pair of rows at once:
+# 1 - the root mean squared difference, truncated to 5 decimals (bit-for-bit the same values)
+def euclidean_similarity(X, block_size=BLOCK_SIZE):
+    X = np.asarray(X, dtype=np.float64)
+    squares = symmetric_matrix(X, squared_euclidean_exact, block_size)
+    return np.trunc((1 - np.sqrt(squares / X.shape[1])) * 100000) / 100000
+
+
+# the k nearest rows of X to every query row (every row of X if queries is None, in which case a row
+# isn't its own neighbor), computed one tile of query rows at a time so only a tile x n block of
+# distances exists at once (TILE_ELEMENTS by default); each tile keeps its k smallest with argpartition
+# workers > 1 spreads the tiles over a thread pool (numpy releases the GIL in the heavy parts)
+# output is an optional path prefix: the results are then written tile by tile to
+# <output>.indices.npy and <output>.distances.npy (memory mapped) instead of kept in memory
+# returns (indices, distances), both len(queries) x k, nearest first
+def top_k(X, k, metric='euclidean', queries=None, block_size=None, workers=1, output=None):
+    X = np.asarray(X, dtype=np.float64)
+    block_size = block_size or max(1, TILE_ELEMENTS // len(X))
+    exclude_self = queries is None
+    queries = X if queries is None else np.asarray(queries, dtype=np.float64)
+    k = min(k, len(X) - 1 if exclude_self else len(X))
+
+    if output:
+        indices = np.lib.format.open_memmap(output + '.indices.npy', mode='w+', dtype=np.int64, shape=(len(queries), k))
+        distances = np.lib.format.open_memmap(output + '.distances.npy', mode='w+', shape=(len(queries), k))
+    else:
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        distances = np.empty((len(queries), k))
+
+    def tile(start):
+        end = min(start + block_size, len(queries))
+        # euclidean neighbors are ranked on squared distances; only the k kept get a sqrt
+        if metric == 'euclidean':
+            block = squared_euclidean_blas(queries[start:end], X)
+        else:
+            block = distance_block(queries[start:end], X, metric)
+        rows = np.arange(end - start)[:, None]
+        if exclude_self:
+            block[rows[:, 0], np.arange(start, end)] = np.inf
+        nearest = np.argpartition(block, k - 1, axis=1)[:, :k] if k < len(X) else np.tile(np.arange(len(X)), (end - start, 1))
+        order = np.argsort(block[rows, nearest], axis=1, kind='stable')
+        indices[start:end] = nearest[rows, order]
+        nearest_distances = block[rows, indices[start:end]]
+        distances[start:end] = np.sqrt(nearest_distances) if metric == 'euclidean' else nearest_distances
+
+    starts = range(0, len(queries), block_size)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(tile, starts))
+    else:
+        for start in starts:
+            tile(start)
+
+    if output:
+        indices.flush()
+        distances.flush()
+    return indices, distances
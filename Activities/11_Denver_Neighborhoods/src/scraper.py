@@ -4,39 +4,131 @@
 
 from helper_methods import *
 
-import csv
 import os
 import re
-import requests
-from bs4 import BeautifulSoup
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+
+requests = lazy_import('requests')
+bs4 = lazy_import('bs4')
 
 # definitions/parameters
 DATA_FOLDER = os.path.join("..", "data")
 CSV_FILE_NAME = 'denver_neighborhoods.csv'
+PAGES_FOLDER = os.path.join(DATA_FOLDER, 'pages')
 BASE_URL = 'https://www.5280.com/neighborhoods/'
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (X11; CrOS x86_64 12871.102.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.141 Safari/537.36"}
+WORKERS = 4             # detail pages fetched at once
+DELAY = 0.5             # seconds between two requests to the site
+CRAWL_TTL = 0           # cached pages are always revalidated, so a re-crawl downloads only what changed
+
+
+# a requests session that keeps up to connections connections to a host open and sends HEADERS
+def open_session(connections=WORKERS):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=connections)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
+# politeness: spaces the requests of all threads at least delay seconds apart
+class RateLimiter:
+
+    def __init__(self, delay=DELAY):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.delay
+        time.sleep(start - now)
+
+
+# links of the index table that stay on the same site, in table order, without duplicates
+def detail_links(html, base_url):
+    soup = bs4.BeautifulSoup(html, "lxml", parse_only=bs4.SoupStrainer('table'))
+    table = soup.table
+    links = {}
+    for anchor in table.find_all('a', href=True) if table else []:
+        url = urljoin(base_url, anchor['href']).split('#')[0]
+        if urlparse(url).netloc == urlparse(base_url).netloc:
+            links.setdefault(url, None)
+    return list(links)
+
+
+# file a detail page is saved to: the last part of its path (/neighborhoods/cherry-creek/ -> cherry-creek.html)
+def page_file(url):
+    name = urlparse(url).path.rstrip('/').rsplit('/', 1)[-1] or 'index'
+    return os.path.join(PAGES_FOLDER, re.sub(r'[^\w.-]+', '_', name) + '.html')
+
+
+# fetches one page through the cache (a conditional GET once it has been fetched before)
+# saves it when it was downloaded; returns (url, status code, downloaded)
+# a page that can't be fetched or saved has the error message as its status, so one bad page doesn't stop the crawl
+def fetch_page(url, session, limiter, cache):
+    limiter.wait()
+    try:
+        response = cached_get(url, ttl=CRAWL_TTL, cache=cache, session=session)
+        downloaded = response.status_code == 200 and not response.from_cache
+        if response.status_code == 200 and (downloaded or not os.path.exists(page_file(url))):
+            with open(page_file(url), 'wb') as file:
+                file.write(response.content)
+    except (requests.RequestException, OSError) as error:
+        return url, f"{type(error).__name__}: {error}", False
+    return url, response.status_code, downloaded
+
+
+# crawls the index page and every detail page it links to, workers pages at a time
+# returns the (url, status code or error, downloaded) of every detail page
+def crawl(base_url=BASE_URL, workers=WORKERS, delay=DELAY, cache=None):
+    folder_exists(PAGES_FOLDER)
+    cache = cache or HttpCache()
+    limiter = RateLimiter(delay)
+    with open_session(workers) as session:
+        limiter.wait()
+        index = cached_get(base_url, ttl=CRAWL_TTL, cache=cache, session=session)
+        if index.status_code != 200:
+            raise RuntimeError(f"{base_url}: HTTP {index.status_code}")
+        links = detail_links(index.content, base_url)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda url: fetch_page(url, session, limiter, cache), links))
 
 
 def main():
     # Ensure destination folder exists
     folder_exists(DATA_FOLDER)
 
-    # Retrieve data
-    response = requests.session().get(BASE_URL)
-    soup = BeautifulSoup(response.content, "html.parser")
-    rows = soup.table.find_all('tr')
+    # Retrieve data (numeric columns come back typed, with currency symbols and commas removed)
+    with open_session() as session:
+        response = session.get(BASE_URL)
+    data = html_table(response.content)
 
     # Write to CSV
-    with open(os.path.join(DATA_FOLDER, CSV_FILE_NAME), 'w', newline='') as file:
-        writer = csv.writer(file)
-        for row in rows:
-            data = []
-            for td in row.find_all(['th', 'td']):
-                data.append(re.sub("[,$]", '', td.string))     # remove currency symbols
-            writer.writerow(data)
-        file.close()
+    data.to_csv(os.path.join(DATA_FOLDER, CSV_FILE_NAME), index=False)
 
 
 if __name__ == "__main__":
-    main()
+
+    # usage: scraper.py [crawl [base url]]
+    #   without arguments: writes the index table to denver_neighborhoods.csv
+    #   crawl: also fetches every neighborhood page the table links to into data/pages
+    if len(sys.argv) > 1 and sys.argv[1] == 'crawl':
+        start = time.perf_counter()
+        pages = crawl(sys.argv[2] if len(sys.argv) > 2 else BASE_URL)
+        downloaded = sum(page[2] for page in pages)
+        failed = [page for page in pages if page[1] != 200]
+        print(f"{len(pages)} pages: {downloaded} downloaded, {len(pages) - downloaded - len(failed)} not modified, "
+              f"{len(failed)} failed ({time.perf_counter() - start:.2f}s)")
+        for url, status, _ in failed:
+            print(f"  {'HTTP ' if isinstance(status, int) else ''}{status}: {url}")
+    else:
+        main()
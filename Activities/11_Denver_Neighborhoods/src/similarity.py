@@ -3,12 +3,15 @@
 # Description: Activity 11: similarity analysis of neighborhoods in the Denver metro area
 
 from helper_methods import *
+from distances import euclidean_similarity, top_k
+from rendering import show
 
 import os
 import math
-import pandas
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
+
+plt = lazy_import('matplotlib.pyplot')
 
 
 # definitions/parameters
@@ -17,10 +20,13 @@ CSV_FILE_NAME = 'denver_neighborhoods.csv'
 columns = ['Neighborhood',  'Population', '2020 Average Sale Price', 'Schools Score', 'Crime Rank', 'X Factor Score']
 
 
+# usage: similarity.py [neighborhood [k]]
+#   without arguments: heatmap of the similarity of every pair of neighborhoods
+#   with a neighborhood: the k (default 5) neighborhoods most similar to it
 def main():
     # Retrieve data from csv file
     file_exists(filepath := os.path.join(DATA_FOLDER, CSV_FILE_NAME), "Data file not found.")
-    data = pandas.read_csv(filepath, index_col=0, usecols=columns)
+    data = read_csv_cached(filepath, index_col=0, usecols=columns)
     neighborhoods = data.index.values
 
 
@@ -32,15 +38,24 @@ def main():
         normalized[column] = (normalized[column] - min) / (max - min)
 
 
-    # Euclidean comparisons
-    euclidean = []
-    for neighborhood_1 in normalized.iterrows():
-        row_data = []
-        for neighborhood_2 in normalized.iterrows():
-            a = normalized.loc[neighborhood_1[0]].values
-            b = normalized.loc[neighborhood_2[0]].values
-            row_data.append(eucl_dist(a, b))
-        euclidean.append(row_data)
+    # The k most similar neighborhoods (nearest rows) to the one given; no n x n matrix is built
+    if len(sys.argv) > 1:
+        name = sys.argv[1]
+        k = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+        if name not in data.index:
+            print(f"Unknown neighborhood '{name}'.")
+            return
+        row = data.index.get_loc(name)
+        indices, distances = top_k(normalized.values, k + 1, queries=normalized.values[row:row + 1])
+        nearest = [(i, d) for i, d in zip(indices[0], distances[0]) if i != row][:k]
+        for i, distance in nearest:
+            similarity = int((1 - distance / math.sqrt(len(normalized.columns))) * 100000) / 100000
+            print(f"{neighborhoods[i]:<30}{similarity:>10}")
+        return
+
+
+    # Euclidean comparisons (same values as eucl_dist on every pair, computed as one matrix)
+    euclidean = euclidean_similarity(normalized.values)
 
 
     # Configure Plot            extensive help from https://matplotlib.org/stable/gallery/images_contours_and_fields/image_annotated_heatmap.html#sphx-glr-gallery-images-contours-and-fields-image-annotated-heatmap-py
@@ -57,9 +72,11 @@ def main():
 
     # Rotate the tick labels and set their alignment.
     plt.setp(ax.get_xticklabels(), rotation=90, ha="right", rotation_mode="anchor")
-    plt.show()
+    show('similarity')
 
 
+# similarity of two rows (1 - root mean squared difference); distances.euclidean_similarity
+# computes the same values for all pairs at once
 def eucl_dist(a, b): 
     sum = 0
     for i in range(len(a)):
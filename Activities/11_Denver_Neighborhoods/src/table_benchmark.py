@@ -0,0 +1,74 @@
+# CS390Z - Introduction to Data Mining - Fall 2021
+# Instructor: Thyago Mota
+# Description: Activity 11: benchmark of html_table against the original table scraping path on saved HTML fixtures
+
+from helper_methods import html_table
+
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from bs4 import BeautifulSoup
+
+# definitions/parameters
+ROWS = [1000, 10000, 50000]
+FILLER = 2000           # paragraphs of page content around the table
+RUNS = 3
+SEED = 390
+
+
+# a neighborhoods page: navigation and article text around one table of rows rows
+def fixture(rows, rng):
+    filler = ''.join(f"<div class='post'><p>Paragraph {i} about <a href='/p/{i}'>Denver</a>.</p></div>"
+                     for i in range(FILLER))
+    body = ''.join(f"<tr><td><a href='/neighborhoods/n-{i}/'>Neighborhood {i}</a></td><td>{rng.randrange(500, 40000):,}</td>"
+                   f"<td>${rng.randrange(200000, 2000000):,}</td><td>{rng.randrange(1, 11) / 2}</td>"
+                   f"<td>{rng.randrange(1, 80)}</td><td>{rng.randrange(1, 21) / 2}</td></tr>" for i in range(rows))
+    header = "<tr><th>Neighborhood</th><th>Population</th><th>2020 Average Sale Price</th><th>Schools Score</th>" \
+             "<th>Crime Rank</th><th>X Factor Score</th></tr>"
+    return f"<html><head><script>var x = 1;</script></head><body>{filler}<table>{header}{body}</table>{filler}</body></html>"
+
+
+# the path scraper.py used: html.parser over the whole page, find_all('tr') / find_all(['th', 'td']), strings only
+def original(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return [[re.sub("[,$]", '', td.string) for td in row.find_all(['th', 'td'])] for row in soup.table.find_all('tr')]
+
+
+def best_time(function, html):
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = function(html)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == "__main__":
+
+    # usage: table_benchmark.py [rows ...]
+    sizes = [int(rows) for rows in sys.argv[1:]] or ROWS
+    rng = random.Random(SEED)
+
+    print(f"{'rows':>8}{'page MB':>9}{'original s':>12}{'html_table s':>14}{'speedup':>9}")
+    with tempfile.TemporaryDirectory() as folder:
+        for rows in sizes:
+            filepath = os.path.join(folder, f"neighborhoods_{rows}.html")
+            with open(filepath, 'w') as file:
+                file.write(fixture(rows, rng))
+            with open(filepath, 'rb') as file:
+                html = file.read()
+
+            original_time, table = best_time(original, html)
+            new_time, data = best_time(html_table, html)
+
+            # same table: names as text, every other column numeric with the same values
+            assert list(data.columns) == table[0] and len(data) == len(table) - 1
+            assert data.iloc[:, 0].tolist() == [row[0] for row in table[1:]]
+            for i in range(1, len(table[0])):
+                assert data.iloc[:, i].astype(float).tolist() == [float(row[i]) for row in table[1:]]
+
+            print(f"{rows:>8}{len(html) / 2 ** 20:>9.1f}{original_time:>12.2f}{new_time:>14.2f}"
+                  f"{original_time / new_time:>8.1f}x")
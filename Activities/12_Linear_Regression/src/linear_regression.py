@@ -1,12 +1,15 @@
 # CS390Z - Introduction to Data Mining - Fall 2021
 # Instructor: Thyago Mota
 # Description: correlation analysis and linear regression (attempt)
+
+from helper_methods import read_csv_cached, lazy_import
+from rendering import show, scatter
+
 import math
 import os
-import pandas as pd
-import numpy as np
-from sklearn.linear_model import LinearRegression
-import matplotlib.pyplot as plt
+
+linear_model = lazy_import('sklearn.linear_model')
+plt = lazy_import('matplotlib.pyplot')
 
 # definitions/parameters
 DATA_FOLDER = os.path.join("..", "data")
@@ -18,7 +21,7 @@ def main():
     # TODO: create a pandas data frame from the CSV file
     # (optional) TODO: define the country as the index for the data frame
     # (optional) TODO: remove all columns except 'gdp_per_capita' and 'life_expectancy' from the data frame
-    df = pd.read_csv(
+    df = read_csv_cached(
         os.path.join(DATA_FOLDER, DATASET_NAME),
         index_col=COLUMNS[0],
         usecols=COLUMNS
@@ -35,15 +38,15 @@ def main():
     x = df["gdp_per_capita"].values.reshape(-1, 1)
     y = df["life_expectancy"].values
 
-    model = LinearRegression().fit(x, y)
+    model = linear_model.LinearRegression().fit(x, y)
     r_sq = model.score(x, y)
     print("r2 score:", r_sq, "\n")
 
     # TODO: produce a visualization of the data points and the fitted line
     y_pred = model.predict(x)
-    plt.scatter(x, y)
+    scatter(plt.gca(), x, y)
     plt.plot(x, y_pred, c="black")
-    plt.show()
+    show('gdp_life_expectancy')
 
 
 if __name__ == "__main__":
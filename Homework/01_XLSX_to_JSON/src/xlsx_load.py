@@ -4,16 +4,30 @@
 # Description: Homework 01 - XLSX Data Load
 
 from zipfile import ZipFile
-from bs4 import BeautifulSoup
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import xml.etree.ElementTree as ET
+import argparse
+import csv
+import mmap
 import os
 import json
+import re
+import shutil
+import tempfile
+import time
 
 # definitions/parameters
 DATA_FOLDER =           os.path.join("..", "data")
-ATHLETES_FILE_NAME =    os.path.join(DATA_FOLDER, "xl", "worksheets", "sheet1.xml")
-SS_FILE_NAME =          os.path.join(DATA_FOLDER, "xl", "sharedStrings.xml")
-JSON_FILE_NAME =        os.path.join(DATA_FOLDER, "athletes.json")
+SHEET_MEMBER =          "xl/worksheets/sheet1.xml"     # used when the workbook doesn't list its sheets
+SS_MEMBER =             "xl/sharedStrings.xml"
 XLSX_FILE_NAME =        os.path.join(DATA_FOLDER, "Athletes.xlsx")
+NS =                    "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+R_NS =                  "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+SS_CACHE_SIZE =         65536       # decoded shared strings kept in memory
+SI_PATTERN =            re.compile(rb'<(?:[\w.-]+:)?si\s*/>|<(?P<prefix>(?:[\w.-]+:)?)si[\s>].*?</(?P=prefix)si>', re.S)
+PARQUET_BATCH =         65536       # rows per parquet row group
 
 
 def file_exists(filepath, exit_if_missing=False):
@@ -30,57 +44,352 @@ def file_exists(filepath, exit_if_missing=False):
             return False
 
 
+def local_name(tag):
+    # tag without its namespace ({http://...}t -> t)
+    return tag.rsplit('}', 1)[-1]
+
+
 def strip_digits(string):
     # thanks, https://stackoverflow.com/questions/12851791/removing-numbers-from-string
     return ''.join(i for i in string if not i.isdigit())
 
 
+class SharedStrings:
+    # The shared string table, without materializing every string: a copy of sharedStrings.xml
+    # is memory mapped and indexed by the byte range of each <si> entry; entries are then
+    # decoded on demand, and the most recently used ones kept in an LRU.
+    # starts/ends reuse an index built before (e.g. by the parent of a worker process).
+
+    def __init__(self, path, starts=None, ends=None, cache_size=SS_CACHE_SIZE, owner=False):
+        self.path = path
+        self.owner = owner          # the file is a temporary copy, deleted on close
+        self.file = open(path, 'rb')
+        self.buffer = b''
+        if os.path.getsize(path) > 0:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if starts is None:
+            starts, ends = array('q'), array('q')
+            for match in SI_PATTERN.finditer(self.buffer):
+                starts.append(match.start())
+                ends.append(match.end())
+        self.starts = starts
+        self.ends = ends
+        self.get = lru_cache(maxsize=cache_size)(self.decode)
+
+    # copies the table out of the archive (deflated zip members can't be seeked)
+    @classmethod
+    def from_archive(cls, archive, member=SS_MEMBER, cache_size=SS_CACHE_SIZE):
+        with tempfile.NamedTemporaryFile(suffix='.xml', delete=False) as copy:
+            if member in archive.namelist():
+                with archive.open(member) as source:
+                    shutil.copyfileobj(source, copy)
+        return cls(copy.name, cache_size=cache_size, owner=True)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        return self.get(index)
+
+    # text of entry index; a rich-text entry (several <r> runs) is joined into one string,
+    # and phonetic hints (<rPh>) are left out
+    # entries written with a namespace prefix (<x:si>, as the OpenXML SDK does) are parsed inside
+    # an element declaring that prefix, and their elements matched by local name
+    def decode(self, index):
+        fragment = self.buffer[self.starts[index]:self.ends[index]]
+        prefix = re.match(rb'<([\w.-]+):', fragment)
+        if prefix:
+            fragment = b'<sst xmlns:' + prefix.group(1) + b'="' + NS[1:-1].encode() + b'">' + fragment + b'</sst>'
+            si = ET.fromstring(fragment)[0]
+        else:
+            si = ET.fromstring(fragment)
+        texts = []
+        for child in si:
+            if local_name(child.tag) == 't':
+                texts.append(child.text or '')
+            elif local_name(child.tag) == 'r':
+                texts.extend(t.text or '' for t in child if local_name(t.tag) == 't')
+        return ''.join(texts)
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+        if self.owner:
+            os.remove(self.path)
+
+
+def cell_value(cell, shared_strings):
+    # Value of a <c> element by its type (t attribute): shared string, number (the default),
+    # boolean, inline string, or text (formula strings, errors, dates); None for an empty cell
+
+    kind = cell.get('t', 'n')
+    if kind == 'inlineStr':
+        inline = cell.find(NS + 'is')
+        if inline is None:
+            return None
+        return ''.join(t.text or '' for t in inline.findall(NS + 't') + inline.findall(f"{NS}r/{NS}t"))
+
+    value = cell.find(NS + 'v')
+    if value is None or value.text is None:
+        return None
+    if kind == 's':
+        return shared_strings[int(value.text)]
+    if kind == 'n':
+        number = float(value.text)
+        return int(number) if number.is_integer() and not re.search('[.eE]', value.text) else number
+    if kind == 'b':
+        return value.text == '1'
+    return value.text
+
+
+def iter_rows(archive, member, shared_strings):
+    # Yields every row of a worksheet as {column letter: value}, parsing the zip member as
+    # a stream; each row element is dropped once read, so only one row is in memory at a time
+
+    sheet_data = None
+    with archive.open(member) as file:
+        for event, element in ET.iterparse(file, events=('start', 'end')):
+            if event == 'start':
+                if element.tag == NS + 'sheetData':
+                    sheet_data = element
+                continue
+            if element.tag != NS + 'row':
+                continue
+
+            row = {}
+            for cell in element.iter(NS + 'c'):
+                value = cell_value(cell, shared_strings)
+                if value is not None:
+                    row[strip_digits(cell.get('r'))] = value
+            yield row
+            sheet_data.remove(element)
+
+
+def workbook_sheets(archive):
+    # Returns [(sheet name, worksheet member)] in workbook order, following the workbook's
+    # relationships from each sheet to its xml file
+
+    if 'xl/workbook.xml' not in archive.namelist():
+        return [('sheet1', SHEET_MEMBER)]
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    relationships = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {relationship.get('Id'): relationship.get('Target') for relationship in relationships}
+
+    sheets = []
+    for sheet in workbook.iter(NS + 'sheet'):
+        target = targets[sheet.get(R_NS + 'id')]
+        sheets.append((sheet.get('name'), target[1:] if target.startswith('/') else 'xl/' + target))
+    return sheets
+
+
+class JsonWriter:
+    # a json array with one compact record per line (indent=1 doubled the size and write time)
+    extension = 'json'
+
+    def __init__(self, path, columns):
+        self.file = open(path, 'w')
+        self.file.write('[')
+        self.count = 0
+
+    def write(self, record):
+        self.file.write((",\n" if self.count else "\n") + json.dumps(record))
+        self.count += 1
+
+    def close(self):
+        self.file.write("\n]\n" if self.count else "]\n")
+        self.file.close()
+
+
+class JsonLinesWriter:
+    # one json record per line
+    extension = 'jsonl'
+
+    def __init__(self, path, columns):
+        self.file = open(path, 'w')
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class CsvWriter:
+    # a header line with the column names, then one line per record (cells without a header are left out)
+    extension = 'csv'
+
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=columns, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, record):
+        self.writer.writerow(record)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    # records buffered into row groups of PARQUET_BATCH rows; column types come from the first group,
+    # with every number stored as a double (as xlsx does) so int and float cells can share a column,
+    # and a column that mixes types (42 and "N/A") stored as text. When a later group doesn't fit a
+    # column's type, the rows written so far are read back and rewritten with that column as text.
+    extension = 'parquet'
+
+    def __init__(self, path, columns):
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.path = path
+        self.columns = columns
+        self.batch = []
+        self.writer = None
+
+    def write(self, record):
+        self.batch.append(record)
+        if len(self.batch) >= PARQUET_BATCH:
+            self.flush()
+
+    # a cell as text, for the columns stored as text
+    @staticmethod
+    def text(value):
+        if value is None or isinstance(value, str):
+            return value
+        if isinstance(value, bool):
+            return 'true' if value else 'false'         # as arrow casts booleans to strings
+        return str(value)
+
+    def column_type(self, values):
+        pa = self.pyarrow
+        try:
+            kind = pa.array(values).type
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return pa.string()
+        if pa.types.is_integer(kind):
+            return pa.float64()
+        if pa.types.is_null(kind):
+            return pa.string()
+        return kind
+
+    # rewrites the file written so far with column as text
+    def widen(self, column):
+        pa = self.pyarrow
+        self.writer.close()
+        table = pa.parquet.read_table(self.path)
+        index = table.schema.get_field_index(column)
+        table = table.set_column(index, pa.field(column, pa.string()), table.column(index).cast(pa.string()))
+        self.writer = pa.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table, row_group_size=PARQUET_BATCH)
+
+    def flush(self):
+        pa = self.pyarrow
+        data = {column: [record.get(column) for record in self.batch] for column in self.columns}
+        if self.writer is None:
+            schema = pa.schema([(column, self.column_type(values)) for column, values in data.items()])
+            self.writer = pa.parquet.ParquetWriter(self.path, schema)
+        arrays = []
+        for field in self.writer.schema:
+            values = data[field.name]
+            if pa.types.is_string(field.type):
+                values = [self.text(value) for value in values]
+            try:
+                arrays.append(pa.array(values, type=field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                self.widen(field.name)
+                return self.flush()
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.writer.schema))
+        self.batch = []
+
+    def close(self):
+        if self.batch or self.writer is None:
+            self.flush()
+        self.writer.close()
+
+
+WRITERS = {writer.extension: writer for writer in (JsonWriter, JsonLinesWriter, CsvWriter, ParquetWriter)}
+
+# the shared string table each worker process reads from (set once per worker by init_worker)
+worker_strings = None
+
+
+# attaches a worker to the parent's copy of the shared string table and reuses its index
+def init_worker(path, starts, ends):
+    global worker_strings
+    worker_strings = SharedStrings(path, starts, ends)
+
+
+def convert_sheet(task, shared_strings=None):
+    # Streams one worksheet into its output file, one record per data row keyed by the
+    # (lowercase) headers in row 1; task is (xlsx path, sheet name, member, output path, format)
+    # Reads the worker's shared string table unless shared_strings is given
+    # Returns the sheet's statistics
+
+    xlsx_path, name, member, path, format = task
+    start = time.perf_counter()
+    count = 0
+    with ZipFile(xlsx_path) as archive:
+        rows = iter_rows(archive, member, worker_strings if shared_strings is None else shared_strings)
+        column_header = {column: str(value).lower() for column, value in next(rows, {}).items()}
+        writer = WRITERS[format](path, list(column_header.values()))
+        try:
+            for row in rows:
+                record = {column_header.get(column, column): value for column, value in row.items()}
+                if record:
+                    writer.write(record)
+                    count += 1
+        finally:
+            writer.close()
+    return {'sheet': name, 'file': path, 'rows': count, 'seconds': time.perf_counter() - start}
+
+
+def output_file(folder, xlsx_path, sheet, format, single):
+    # <workbook>.<format> for a single sheet (Athletes.xlsx -> athletes.json),
+    # <workbook>.<sheet>.<format> otherwise
+
+    stem = os.path.splitext(os.path.basename(xlsx_path))[0].lower()
+    if not single:
+        stem += '.' + re.sub(r'[^\w.-]+', '_', sheet)
+    return os.path.join(folder, f"{stem}.{format}")
+
+
+def convert(xlsx_path, folder, format='json', workers=None):
+    # Converts every sheet of the workbook, in parallel worker processes when there is more than one
+    # The shared string table is indexed once here and handed to the workers
+    # Returns the statistics of every sheet
+
+    with ZipFile(xlsx_path) as archive:
+        sheets = workbook_sheets(archive)
+        shared_strings = SharedStrings.from_archive(archive)
+    try:
+        tasks = [(xlsx_path, name, member, output_file(folder, xlsx_path, name, format, len(sheets) == 1), format)
+                 for name, member in sheets]
+        if len(tasks) == 1 or workers == 1:
+            return [convert_sheet(task, shared_strings) for task in tasks]
+        initargs = (shared_strings.path, shared_strings.starts, shared_strings.ends)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as pool:
+            return list(pool.map(convert_sheet, tasks))
+    finally:
+        shared_strings.close()
+
+
 if __name__ == "__main__":
 
-    # TODO: If either xml file is missing, extract data from XLSX
-    if not (file_exists(SS_FILE_NAME) and file_exists(ATHLETES_FILE_NAME)):
-
-        # Quit with error if Athletes.xlsx is also missing
-        file_exists(file := XLSX_FILE_NAME, True)
-        with ZipFile(file, 'r') as zipObj:
-            zipObj.extractall(DATA_FOLDER)
-
-        # Confirm both xml files now exist; exit with error if still missing
-        file_exists(SS_FILE_NAME, True)
-        file_exists(ATHLETES_FILE_NAME, True)
-
-    # TODO: creates a list with all strings found in "sharedStrings.xml"
-    with open(SS_FILE_NAME) as file:
-        soup = BeautifulSoup(file, "xml")
-        file.close()
-    shared_strings = list(soup.stripped_strings)
-
-    # TODO: read contents of "athletes.xml" into a list of dictionaries
-    with open(ATHLETES_FILE_NAME) as file:
-        soup = BeautifulSoup(file, "xml")
-        file.close()
-
-    athlete_list = []
-    column_header = {}
-    rows = soup.find_all('row')
-
-    for row in rows:
-        athlete = {}
-        for cell in row.children:
-            column_letter = strip_digits(cell['r'])
-            cell_value = shared_strings[int(cell.string)]
-
-            if row['r'] == "1":
-                column_header[column_letter] = cell_value.lower()
-
-            else:
-                key = column_header[column_letter]
-                athlete[key] = cell_value
-
-        if not athlete == {}:
-            athlete_list.append(athlete)
-
-    # TODO: write list into json file
-    with open(JSON_FILE_NAME, "w") as outfile:
-        json.dump(athlete_list, outfile, indent=1)
-        outfile.close()
+    parser = argparse.ArgumentParser(description="Convert every sheet of an xlsx workbook.")
+    parser.add_argument('xlsx', nargs='?', default=XLSX_FILE_NAME)
+    parser.add_argument('--format', choices=list(WRITERS), default='json')
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per cpu)")
+    parser.add_argument('--output', default=DATA_FOLDER, help="output folder")
+    args = parser.parse_args()
+
+    # Quit with error if the workbook is missing; the xml is read straight from the archive
+    file_exists(args.xlsx, True)
+    os.makedirs(args.output, exist_ok=True)
+
+    # Convert the sheets, streaming records into one file per sheet
+    start = time.perf_counter()
+    for sheet in convert(args.xlsx, args.output, args.format, args.workers):
+        print(f"{sheet['sheet']}: {sheet['rows']} records to {os.path.basename(sheet['file'])} "
+              f"({sheet['rows'] / sheet['seconds'] if sheet['seconds'] else 0:.0f} rows/s)")
+    print(f"done in {time.perf_counter() - start:.2f}s")
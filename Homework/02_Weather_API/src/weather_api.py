@@ -2,20 +2,38 @@
 # Instructor: Thyago Mota
 # Description: Homework 02 - Weather API
 
+from helper_methods import HttpCache, cached_get, lazy_import
+
+import asyncio
+import codecs
 import csv
-import urllib.parse
-import requests
+import hashlib
+import random
+import sys
+import time
 import json
 import os
-import gzip
+import re
+import sqlite3
+import zlib
 from datetime import datetime
 
+requests = lazy_import('requests')
+
 # definitions/parameters
 DATA_FOLDER = os.path.join('..', 'data')
 LOCATIONS_FILE_NAME = 'locations.csv'
 JSON_FILE_NAME = 'weather.json'
 OPEN_WEATHER_API = 'http://api.openweathermap.org/data/2.5/weather'
+OPEN_WEATHER_GROUP_API = 'http://api.openweathermap.org/data/2.5/group'
+GROUP_SIZE = 20             # city ids per group call (the API's maximum)
+CALLS_PER_MINUTE = 60       # API quota
+CONNECTIONS = 10            # concurrent connections in async mode
+RETRIES = 4
+WEATHER_TTL = 10 * 60       # seconds a weather response is reused (the API updates about every 10 minutes)
 CITY_LIST_URL = 'http://bulk.openweathermap.org/sample/city.list.json.gz'
+CITY_INDEX_FILE_NAME = 'city_index.sqlite3'
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')     # what a chunk may end in while a number goes on in the next one
 
 
 def quit_msg(msg):
@@ -23,7 +41,289 @@ def quit_msg(msg):
     quit()
 
 
+# opens (creating if needed) the persistent (name, state, country) -> id index
+def open_city_index(filepath):
+    db = sqlite3.connect(filepath, isolation_level=None)     # transactions are managed explicitly
+    db.execute("""CREATE TABLE IF NOT EXISTS cities (
+                    name TEXT, state TEXT, country TEXT, id INTEGER,
+                    PRIMARY KEY (name, state, country)) WITHOUT ROWID""")
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    return db
+
+
+def get_meta(db, key):
+    row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(db, key, value):
+    db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+
+# decompresses a stream of gzip chunks as they arrive (handles multi-member files)
+def gunzip_chunks(chunks):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            chunk = decompressor.unused_data
+            if chunk:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    yield decompressor.flush()
+
+
+# yields the elements of a top-level JSON array read from a stream of text chunks
+# only the current element (plus one chunk) is held in memory
+def iter_json_array(text_chunks):
+    decoder = json.JSONDecoder()
+    chunks = iter(text_chunks)
+    buffer, position, started, done = '', 0, False, False
+
+    # returns False at the end of the input
+    def read_more():
+        nonlocal buffer, position
+        for chunk in chunks:
+            if chunk:
+                buffer = buffer[position:] + chunk
+                position = 0
+                return True
+        return False
+
+    while True:
+        # skip whitespace, the opening bracket and separators
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[':
+            if buffer[position] == '[':
+                started = True
+            elif buffer[position] == ',' and not started:
+                raise ValueError("Expected a JSON array.")
+            position += 1
+        if position == len(buffer):
+            if not read_more():
+                break
+            continue
+        if buffer[position] == ']':
+            done = True
+            break
+        if not started:
+            raise ValueError("Expected a JSON array.")
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if not read_more():         # the element continues in the next chunk
+                raise
+            continue
+        if NUMBER_TAIL.match(buffer, end) and read_more():
+            continue                    # a number or literal cut at the end of the chunk may go on in the next
+        position = end
+        yield element
+
+    if not done:
+        raise ValueError("Unterminated JSON array.")
+
+
+# streams the city list straight from the download through gunzip and the JSON parser into the index
+# the rows go into a staging table that replaces the index only once the whole list has been read,
+# and only if the compressed file differs from the one the index was built from
+# returns True if the index was rebuilt
+def refresh_city_index(db, url):
+    headers = {}
+    if get_meta(db, 'sha1'):
+        if etag := get_meta(db, 'etag'):
+            headers['If-None-Match'] = etag
+        if last_modified := get_meta(db, 'last_modified'):
+            headers['If-Modified-Since'] = last_modified
+
+    with requests.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            return False
+        if response.status_code != 200:
+            quit_msg(f"Failed to retrieve content. Status code:{response.status_code}")
+
+        digest = hashlib.sha1()
+
+        def compressed():
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                digest.update(chunk)
+                yield chunk
+
+        text = codecs.iterdecode(gunzip_chunks(compressed()), 'utf-8')
+        cities = iter_json_array(text)
+
+        db.execute("BEGIN")
+        try:
+            db.execute("DROP TABLE IF EXISTS cities_new")
+            db.execute("""CREATE TABLE cities_new (
+                            name TEXT, state TEXT, country TEXT, id INTEGER,
+                            PRIMARY KEY (name, state, country)) WITHOUT ROWID""")
+            # the first city with a given (name, state, country) wins, as with the original list scan
+            db.executemany("INSERT OR IGNORE INTO cities_new VALUES (?, ?, ?, ?)",
+                           ((city['name'], city.get('state', ''), city['country'], city['id']) for city in cities))
+            for _ in text:              # read (and hash) anything after the closing bracket
+                pass
+
+            rebuilt = digest.hexdigest() != get_meta(db, 'sha1')
+            if rebuilt:
+                db.execute("DROP TABLE cities")
+                db.execute("ALTER TABLE cities_new RENAME TO cities")
+                set_meta(db, 'sha1', digest.hexdigest())
+            else:
+                db.execute("DROP TABLE cities_new")
+            set_meta(db, 'etag', response.headers.get('ETag'))
+            set_meta(db, 'last_modified', response.headers.get('Last-Modified'))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return rebuilt
+
+
+# returns the city id, or None if the city isn't in the index
+def lookup_city(db, name, state, country='US'):
+    row = db.execute("SELECT id FROM cities WHERE name = ? AND state = ? AND country = ?",
+                     (name, state, country)).fetchone()
+    return row[0] if row else None
+
+
+# original path: one blocking request per city id (through the response cache when one is given)
+# returns {id: weather json}; ids whose request failed map to the exception
+def fetch_sequential(ids, api_key, url=OPEN_WEATHER_API, cache=None):
+    results = {}
+    with requests.Session() as session:
+        for id in ids:
+            params = {'id': id, 'appid': api_key, 'units': 'imperial'}
+            try:
+                if cache:
+                    response = cached_get(url, params, ttl=WEATHER_TTL, cache=cache, session=session)
+                    if response.status_code != 200:
+                        raise requests.HTTPError(f"HTTP {response.status_code}")
+                else:
+                    response = session.get(url, params=params)
+                    response.raise_for_status()
+                results[id] = response.json()
+            except Exception as e:
+                results[id] = e
+    return results
+
+
+# token bucket: allows bursts of up to capacity calls, refilled at rate calls per second
+# any window of t seconds admits at most capacity + rate * t calls
+class TokenBucket:
+
+    # the bucket that keeps every 60 s window within calls_per_minute: the burst is taken out of the quota
+    @classmethod
+    def per_minute(cls, calls_per_minute, burst):
+        capacity = max(1, min(burst, calls_per_minute // 2))
+        return cls(max(calls_per_minute - capacity, 1) / 60, capacity)
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# a response worth retrying: 429 (over quota) or a server error
+class RetryableResponse(Exception):
+
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+# GETs a json document within the rate limit, retrying 429/5xx responses and connection errors
+# with exponential backoff (or the server's Retry-After)
+# with a cache, fresh cached responses are returned without a call and stale ones are revalidated
+async def get_json(session, bucket, url, params, cache=None):
+    import aiohttp
+    entry = cache.lookup(url, params) if cache else None
+    if entry and entry['fresh']:
+        return json.loads(entry['content'])
+
+    for attempt in range(RETRIES + 1):
+        await bucket.acquire()
+        try:
+            async with session.get(url, params=params, headers=cache.validators(entry) if cache else None) as response:
+                if response.status == 304 and entry:
+                    cache.refresh(url, params, WEATHER_TTL)
+                    return json.loads(entry['content'])
+                if response.status == 429 or response.status >= 500:
+                    raise RetryableResponse(response.status, response.headers.get('Retry-After'))
+                response.raise_for_status()
+                content = await response.read()
+                if cache:
+                    cache.store(url, params, response.headers, content, WEATHER_TTL)
+                return json.loads(content)
+        except (RetryableResponse, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == RETRIES:
+                raise
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after and retry_after.isdigit():
+                await asyncio.sleep(int(retry_after))
+            else:
+                await asyncio.sleep(0.5 * 2 ** attempt * (1 + random.random()))
+
+
+# fetches the weather of many city ids concurrently over a bounded connection pool
+# with group_url, ids go GROUP_SIZE per call through the group endpoint; otherwise one call per id
+# returns {id: weather json}; ids whose request failed map to the exception
+async def fetch_async(ids, api_key, url=OPEN_WEATHER_API, group_url=OPEN_WEATHER_GROUP_API,
+                      connections=CONNECTIONS, calls_per_minute=CALLS_PER_MINUTE, cache=None):
+    import aiohttp
+    bucket = TokenBucket.per_minute(calls_per_minute, connections)
+    params = {'appid': api_key, 'units': 'imperial'}
+    results = {}
+
+    async def fetch_one(session, id):
+        try:
+            results[id] = await get_json(session, bucket, url, dict(params, id=id), cache)
+        except Exception as e:
+            results[id] = e
+
+    async def fetch_group(session, group):
+        try:
+            response = await get_json(session, bucket, group_url, dict(params, id=','.join(map(str, group))), cache)
+            for weather in response.get('list', []):
+                results[weather['id']] = weather
+            for id in group:
+                results.setdefault(id, KeyError("not in group response"))
+        except Exception as e:
+            for id in group:
+                results[id] = e
+
+    connector = aiohttp.TCPConnector(limit=connections)
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        if group_url:
+            groups = [ids[i:i + GROUP_SIZE] for i in range(0, len(ids), GROUP_SIZE)]
+            await asyncio.gather(*(fetch_group(session, group) for group in groups))
+        else:
+            await asyncio.gather(*(fetch_one(session, id) for id in ids))
+    return results
+
+
 if __name__ == "__main__":
+
+    # usage: weather_api.py [async|sequential] (default: async, or sequential when aiohttp isn't installed)
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'async'
+    if mode == 'async':
+        try:
+            import aiohttp
+        except ImportError:
+            print("aiohttp isn't installed; fetching the weather sequentially.")
+            mode = 'sequential'
     today = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
     api_key = os.getenv('API_KEY')
 
@@ -42,51 +342,36 @@ if __name__ == "__main__":
         file.close()
 
 
-    # ## TODO: Download and extract list of city IDs
-    filename = CITY_LIST_URL.split("/")[-1]
-    extension = "." + filename.split(".")[-1]
-    filepath = os.path.join(DATA_FOLDER, filename.replace(extension, ""))
-
-    if not os.path.exists(filepath):
-        if extension != ".gz":
-            quit_msg("Archived file is not in .gz format")
-
-        # download zipped file
-        response = requests.get(CITY_LIST_URL, stream=True)
-        if response.status_code != 200:
-            quit_msg(f"Failed to retrieve content. Status code:{response.status_code}")
-
-        # extract file      (with help from https://stackoverflow.com/a/61195974)
-        try:
-            with urllib.request.urlopen(CITY_LIST_URL) as response:
-                with gzip.GzipFile(fileobj=response) as uncompressed:
-                    file_content = uncompressed.read()
-
-            # write to file in binary mode 'wb'
-            with open(filepath, 'wb') as file:
-                file.write(file_content)
-
-        except Exception as e:
-            quit_msg(f"Download and extraction failed: {e}")
+    # Download the list of city IDs and index it (kept between runs, rebuilt only when it changes)
+    city_index = open_city_index(os.path.join(DATA_FOLDER, CITY_INDEX_FILE_NAME))
+    try:
+        refresh_city_index(city_index, CITY_LIST_URL)
+    except Exception as e:
+        quit_msg(f"Download and indexing failed: {e}")
 
 
     ## TODO:  Retrieve unique city IDs and query API
 
-    file = open(filepath, encoding="utf8")
-    data = json.loads(file.read())
-    file.close()
-    os.remove(filepath)
-
     list = []
     msg = ""
 
+    ids = {(i[0], i[1]): lookup_city(city_index, i[0], i[1]) for i in locations}
+    unique_ids = sorted({id for id in ids.values() if id is not None})
+    cache = HttpCache()
+    if mode == 'sequential':
+        weather = fetch_sequential(unique_ids, api_key, cache=cache)
+    else:
+        weather = asyncio.run(fetch_async(unique_ids, api_key, cache=cache))
+
     for i in locations:
         city, state = i[0], i[1]
         try:
-            # (with help from https://stackoverflow.com/a/45414177 to replace my inefficient loop)
-            id = [obj for obj in data if ((obj['name'], obj['state'], obj['country']) == (city, state, "US"))][0]['id']
-            url = f"{OPEN_WEATHER_API}?id={id}&appid={api_key}&units=imperial"
-            response = requests.get(url, headers={'Cache-control': 'no-cache'}).json()
+            id = ids[(city, state)]
+            if id is None:
+                raise KeyError("city not found")
+            response = weather[id]
+            if isinstance(response, Exception):
+                raise response
 
             entry = {
                 'today': today,
@@ -0,0 +1,85 @@
+# CS390Z - Introduction to Data Minining - Fall 2021
+# Instructor: Thyago Mota
+# Description: Homework 02 - benchmark of the weather fetchers against a local mock of the API
+
+from weather_api import fetch_sequential, fetch_async
+
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# definitions/parameters
+LATENCY = 0.05          # seconds the mock takes to answer each call
+FAILURE_RATE = 0.02     # share of calls answered with 503, to exercise the retries
+CITIES = 1000
+
+
+def mock_weather(id):
+    temp = 40 + id % 50
+    return {'id': id, 'main': {'temp': temp, 'temp_min': temp - 5, 'temp_max': temp + 5}}
+
+
+# answers /weather?id=N and /group?id=N,M,... like the OpenWeather API
+class MockHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        time.sleep(LATENCY)
+        if random.random() < FAILURE_RATE:
+            self.send_response(503)
+            self.end_headers()
+            return
+        url = urlparse(self.path)
+        ids = [int(id) for id in parse_qs(url.query)['id'][0].split(',')]
+        if url.path == '/group':
+            body = {'cnt': len(ids), 'list': [mock_weather(id) for id in ids]}
+        else:
+            body = mock_weather(ids[0])
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# starts the mock on a free local port; returns (server, base url)
+def start_mock_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+
+    # usage: weather_benchmark.py [number of cities]
+    cities = int(sys.argv[1]) if len(sys.argv) > 1 else CITIES
+    ids = list(range(1, cities + 1))
+    server, base_url = start_mock_server()
+    quota = 10 ** 6         # the mock has no quota
+
+    runs = {
+        'sequential': lambda: fetch_sequential(ids, 'key', f"{base_url}/weather"),
+        'async': lambda: asyncio.run(fetch_async(ids, 'key', f"{base_url}/weather", None, calls_per_minute=quota)),
+        'async+group': lambda: asyncio.run(fetch_async(ids, 'key', f"{base_url}/weather", f"{base_url}/group",
+                                                       calls_per_minute=quota)),
+    }
+
+    print(f"{cities} cities, {LATENCY * 1000:.0f} ms latency, {FAILURE_RATE:.0%} failures")
+    print(f"{'mode':<14}{'ok':>8}{'failed':>8}{'seconds':>10}{'cities/s':>10}")
+    for name, run in runs.items():
+        start = time.perf_counter()
+        results = run()
+        seconds = time.perf_counter() - start
+        failed = sum(isinstance(result, Exception) for result in results.values())
+        print(f"{name:<14}{len(results) - failed:>8}{failed:>8}{seconds:>10.2f}{len(results) / seconds:>10.0f}")
+
+    server.shutdown()
@@ -3,13 +3,13 @@
 # Description: Homework 03 - HDI Visualization
 
 from helper_methods import *
+from rendering import show
 
 import os
 import csv
 import math
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FormatStrFormatter
-import pandas
+
+plt = lazy_import('matplotlib.pyplot')
 
 # definitions/parameters
 DATA_FOLDER    = os.path.join('..', 'data')
@@ -26,14 +26,14 @@ def main():
 
     filepath = os.path.join(DATA_FOLDER, HDI_FILE_NAME)
     file_exists(filepath)
-    data = pandas.read_csv(filepath)
+    data = read_csv_cached(filepath, usecols=['Coverage', TARGET_YEAR])
     hdi_values = data.loc[data.Coverage == "Country"][TARGET_YEAR]
 
     plt.hist(hdi_values, bins=bins, align="left", rwidth=0.5)
     plt.title(title)
     plt.xlabel(x_label)
     plt.ylabel(y_label)
-    plt.show()
+    show('hdi_histogram')
 
 
 def file_exists(filepath, quit_message=None):
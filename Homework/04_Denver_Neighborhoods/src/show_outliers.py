@@ -2,11 +2,16 @@
 # Instructor: Thyago Mota
 # Description: Homework 04 - show outliers
 
+from helper_methods import lazy_import
+from rendering import show
+
 import csv
 import os
-import matplotlib.pyplot as plt
+import numpy as np
 import re
 
+plt = lazy_import('matplotlib.pyplot')
+
 
 # definitions/parameters
 DATA_FOLDER = os.path.join('..', 'data')
@@ -15,9 +20,7 @@ CSV_FILE_NAME = 'denver_neighborhoods.csv'
 
 def main():
     neighborhoods, matrix = create_matrix()
-    bp = boxplot(matrix)
-
-    dictionary = dict(zip(neighborhoods, matrix))
+    boxplot(matrix)
 
     verb_phrases = [
         "has a population much",
@@ -27,58 +30,54 @@ def main():
         "has an X-Factor that is much"
     ]
 
-    for i in range(len(bp['fliers'])):
-        outliers = bp['fliers'][i].get_xydata()
-        track_y = []                # prevent errors for identical y-values
-        for x, y in outliers:
-            phrase = verb_phrases[i]
-            direction = 'higher' if y > 0.5 else 'lower'
-            names = [key for key, value in dictionary.items() if value[i] == y]
+    # same points as the box plot's fliers, found by index instead of by looking their values up
+    rows, columns, high = iqr_outliers(matrix)
+    for row, column, above in zip(rows, columns, high):
+        direction = 'higher' if above else 'lower'
+        print(neighborhoods[row], verb_phrases[column], direction, "compared to others.")
+
+    show('outliers')
+
+
+# min-max rescales every column of a 2d array to interval, truncated to 5 decimals like the original min_max
+# (constant columns would divide by zero; they are mapped to the start of the interval)
+def normalize(matrix, interval=(0, 1)):
+    matrix = np.asarray(matrix, dtype=np.float64)
+    mins = matrix.min(axis=0)
+    ranges = matrix.max(axis=0) - mins
+    ranges[ranges == 0] = np.inf
+    return np.trunc(((matrix - mins) / ranges * (interval[1] - interval[0]) + interval[0]) * 100000) / 100000
+
 
-            for name in names:
-                if y not in track_y:
-                    print(name, phrase, direction, "compared to others.")
-            track_y.append(y)
+# outliers of every column by the 1.5 IQR rule (the points plt.boxplot draws as fliers)
+# returns (row indices, column indices, above the upper fence), ordered by column then row
+def iqr_outliers(matrix, whis=1.5):
+    matrix = np.asarray(matrix, dtype=np.float64)
+    q1, q3 = np.percentile(matrix, [25, 75], axis=0)
+    iqr = q3 - q1
+    high = matrix > q3 + whis * iqr
+    outliers = high | (matrix < q1 - whis * iqr)
+    columns, rows = np.nonzero(outliers.T)
+    return rows, columns, high[rows, columns]
 
 
 # The code below was provided for the assignment, rearranged as independent methods
+# returns the (shortened) neighborhood names and their normalized n x 5 matrix
 def create_matrix():
-    matrix = []
     neighborhoods = []
     with open(os.path.join(DATA_FOLDER, CSV_FILE_NAME), 'rt') as csv_file:
         reader = csv.reader(csv_file)
-        row_count = 0
-        for row in reader:
-            row_count += 1
-            if row_count == 1:
-                continue
-            row[0] = re.sub('Washington', 'Was.', row[0])
-            row[0] = re.sub('South', 'S.', row[0])
-            neighborhoods.append(row[0])
-            data = [int(row[1]), int(row[2]), float(row[3]), int(row[4]), float(row[5])]
-            if row_count == 2:
-                mins = list(data)
-                maxs = list(data)
-            else:
-                for i in range(len(data)):
-                    mins[i] = min(mins[i], data[i])
-                    maxs[i] = max(maxs[i], data[i])
-            matrix.append(data)
-    return neighborhoods, [min_max(data, mins, maxs) for data in matrix]
-
-
-def min_max(data, mins, maxs, interval=(0, 1)):
-    return [
-        int(((data[i] - mins[i]) / (maxs[i] - mins[i]) * (interval[1] - interval[0]) + interval[0]) * 100000) / 100000
-        for i in range(len(data))]
+        next(reader)
+        rows = list(reader)
+    for row in rows:
+        name = re.sub('Washington', 'Was.', row[0])
+        neighborhoods.append(re.sub('South', 'S.', name))
+    matrix = np.array([row[1:6] for row in rows], dtype=np.float64)
+    return neighborhoods, normalize(matrix)
 
 
 def boxplot(matrix):
-    columns = [[], [], [], [], []]
-    for data in matrix:
-        for i in range(5):
-            columns[i].append(data[i])
-    bp = plt.boxplot(columns)
+    bp = plt.boxplot(matrix)
     axes = plt.gca()
     axes.set_xticklabels(['pop', 'home$', 'schools', 'crime', 'x factor'])
     plt.title('Neighborhoods in the Denver Metro Area')
@@ -2,10 +2,14 @@
 # Instructor: Thyago Mota
 # Description: correlation analysis and linear regression (attempt)
 
-import pandas as pd
+from helper_methods import read_csv_cached, lazy_import
+from rendering import show, scatter
+
+
 import os
-from sklearn.linear_model import LinearRegression
-import matplotlib.pyplot as plt
+
+linear_model = lazy_import('sklearn.linear_model')
+plt = lazy_import('matplotlib.pyplot')
 
 # definitions/parameters
 DATA_FOLDER = os.path.join('..', 'data')
@@ -17,7 +21,7 @@ if __name__ == "__main__":
     # TODO: create a pandas data frame from the CSV file
     # (optional) TODO: define the country as the index for the data frame
     # (optional) TODO: remove all columns except 'gini' and 'edu_index' from the data frame
-    df = pd.read_csv(
+    df = read_csv_cached(
         os.path.join(DATA_FOLDER, DATASET_NAME),
         index_col=COLUMNS[0],
         usecols=COLUMNS
@@ -33,12 +37,12 @@ if __name__ == "__main__":
     # TODO: attempt a linear regression model, displaying the obtained r2 score
     x = df[COLUMNS[1]].values.reshape(-1, 1)
     y = df[COLUMNS[2]].values
-    model = LinearRegression().fit(x, y)
+    model = linear_model.LinearRegression().fit(x, y)
     r2 = model.score(x, y)
     print("r2 score:", r2, "\n")
 
     # TODO: produce a visualization of the data points and the fitted line
     y_predict = model.predict(x)
-    plt.scatter(x, y)
+    scatter(plt.gca(), x, y)
     plt.plot(x, y_predict, c="black")
-    plt.show()
+    show('gini_edu_index')
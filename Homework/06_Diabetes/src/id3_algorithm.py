@@ -2,16 +2,23 @@
 # Instructor: Thyago Mota
 # Description: Homework 06: ID3 algorithm (for decision trees)
 
-import os, math, sys, random
+from helper_methods import read_csv_cached, lazy_import
+from rendering import show
+
+import os, math, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
 import pandas as pd
-from pandas.core.frame import DataFrame
-from sklearn import tree
-from sklearn.tree import DecisionTreeClassifier, export_text
-import matplotlib.pyplot as plt
+
+plt = lazy_import('matplotlib.pyplot')
 
 # definitions/parameters
 DATA_FOLDER = '../data'
 CSV_FILE_NAME   = 'diabetes.csv'
+TREE_FILE_MAGIC = b'DTRE'
+TREE_FILE_VERSION = 1
+TREE_FILE_HEADER = 16           # magic (4 bytes) + version (4 bytes) + node count (8 bytes)
 
 class DTree: 
 
@@ -42,6 +49,101 @@ class DTree:
         else:
             return self.right.predict(row, target)
 
+# a decision tree flattened into parallel arrays (node 0 is the root)
+# leaves have feature == -1 and hold the predicted target in value
+class FlatTree:
+
+    def __init__(self, feature, threshold, left, right, value):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+
+    def __len__(self):
+        return len(self.feature)
+
+    # builds the arrays from a trained DTree; columns gives the feature index of each attribute
+    @classmethod
+    def from_dtree(cls, dtree, columns):
+        columns = list(columns)
+        feature, threshold, left, right, value = [], [], [], [], []
+        stack = [(dtree, -1, None)]
+        while stack:
+            node, parent, side = stack.pop()
+            index = len(feature)
+            if parent >= 0:
+                (left if side == 'left' else right)[parent] = index
+            if node.left is None and node.right is None:
+                feature.append(-1)
+                threshold.append(0)
+                value.append(node.value)
+            else:
+                feature.append(columns.index(node.attribute))
+                threshold.append(node.value)
+                value.append(0)
+            left.append(-1)
+            right.append(-1)
+            if node.right is not None:
+                stack.append((node.right, index, 'right'))
+            if node.left is not None:
+                stack.append((node.left, index, 'left'))
+        return cls(
+            np.array(feature, dtype='<i4'),
+            np.array(threshold, dtype='<f8'),
+            np.array(left, dtype='<i4'),
+            np.array(right, dtype='<i4'),
+            np.array(value, dtype='<f8')
+        )
+
+    # predicts every row of a 2d array at once, moving all rows down one level per step
+    def predict_batch(self, X):
+        X = np.asarray(X, dtype=float)
+        nodes = np.zeros(len(X), dtype=np.intp)
+        rows = np.arange(len(X))
+        while len(rows) > 0:
+            current = nodes[rows]
+            features = self.feature[current]
+            internal = features >= 0
+            rows, current, features = rows[internal], current[internal], features[internal]
+            goes_left = X[rows, features] <= self.threshold[current]
+            nodes[rows] = np.where(goes_left, self.left[current], self.right[current])
+        return self.value[nodes]
+
+    # writes a header followed by the raw arrays (8-byte columns first to keep them aligned)
+    def save(self, filepath):
+        with open(filepath, 'wb') as file:
+            file.write(TREE_FILE_MAGIC)
+            file.write(np.array([TREE_FILE_VERSION], dtype='<u4').tobytes())
+            file.write(np.array([len(self)], dtype='<u8').tobytes())
+            for array in (self.threshold, self.value, self.feature, self.left, self.right):
+                file.write(array.tobytes())
+
+    # memory maps a file written by save(); the arrays are views over the mapping, nothing is parsed
+    # the header is checked first: the version, and a length that fits the node count (a truncated
+    # file would otherwise give short arrays)
+    @classmethod
+    def load(cls, filepath):
+        dtypes = ('<f8', '<f8', '<i4', '<i4', '<i4')
+        buffer = np.memmap(filepath, dtype=np.uint8, mode='r')
+        if len(buffer) < TREE_FILE_HEADER or bytes(buffer[:4]) != TREE_FILE_MAGIC:
+            raise ValueError(f"'{filepath}' is not a tree file.")
+        version = int(buffer[4:8].view('<u4')[0])
+        if version != TREE_FILE_VERSION:
+            raise ValueError(f"'{filepath}' is a version {version} tree file (expected {TREE_FILE_VERSION}).")
+        n = int(buffer[8:16].view('<u8')[0])
+        expected = TREE_FILE_HEADER + n * sum(np.dtype(dtype).itemsize for dtype in dtypes)
+        if len(buffer) != expected:
+            raise ValueError(f"'{filepath}' has {len(buffer)} bytes, expected {expected} for {n} nodes.")
+        arrays = []
+        offset = TREE_FILE_HEADER
+        for dtype in dtypes:
+            size = n * np.dtype(dtype).itemsize
+            arrays.append(buffer[offset:offset + size].view(dtype))
+            offset += size
+        threshold, value, feature, left, right = arrays
+        return cls(feature, threshold, left, right, value)
+
 # computes the entropy given a data frame
 def entropy(df): 
     target_column = df.iloc[: , -1]
@@ -50,105 +152,188 @@ def entropy(df):
     entropy = [ (-1) * (count / total) * math.log(count / total) for count in target_counts ]
     return sum(entropy)
 
-# computes a dedision tree given a data frame
-# assumes that the last column is the target
-def id3(df):
+# computes the entropy of each row of a matrix of class counts
+def entropy_counts(counts):
+    counts = np.asarray(counts, dtype=float)
+    totals = counts.sum(axis=-1, keepdims=True)
+    p = np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+    logs = np.log(p, out=np.zeros_like(p), where=p > 0)
+    return -(p * logs).sum(axis=-1)
+
+# returns the most common class; ties go to the class seen first in y, as value_counts orders them
+def majority(classes, y):
+    counts = np.bincount(y, minlength=len(classes))
+    tied = counts == counts.max()
+    return classes[y[tied[y]][0]]
+
+# finds the best threshold of one attribute given the node's rows sorted by that attribute
+# (rows are the row numbers, in stable sorted order; among equally good thresholds, the one whose
+# value occurs first in the data wins, as when candidates were tried in unique() order)
+# returns (info gain, threshold), or None if the attribute can't split the node
+def best_split(values, labels, rows, n_classes, current_entropy):
+    n = len(values)
+
+    # cumulative class counts: row i holds the counts of the first i + 1 sorted rows
+    one_hot = np.zeros((n, n_classes))
+    one_hot[np.arange(n), labels] = 1
+    left_counts = np.cumsum(one_hot, axis=0)
+
+    # only the last occurrence of each distinct value is a valid threshold (the max value isn't)
+    candidates = np.flatnonzero(values[:-1] != values[1:])
+    if len(candidates) == 0:
+        return None
+    left_counts = left_counts[candidates]
+    right_counts = one_hot.sum(axis=0) - left_counts
+    left_sizes = candidates + 1
+    right_sizes = n - left_sizes
+
+    info_gains = current_entropy \
+        - entropy_counts(left_counts) * left_sizes / n \
+        - entropy_counts(right_counts) * right_sizes / n
+    first_rows = rows[np.concatenate(([0], candidates[:-1] + 1))]
+    tied = np.flatnonzero(info_gains == info_gains.max())
+    best = tied[np.argmin(first_rows[tied])]
+    return info_gains[best], values[candidates[best]]
+
+# grows a tree over the rows of X; sorted_rows maps each remaining attribute to the node's rows sorted by it
+# types holds the scalar type of each attribute column, so thresholds keep it (147, not 147.0)
+def grow(X, y, classes, columns, types, rows, sorted_rows):
 
     # create a tree node
     tree = DTree()
+    target = columns[-1]
+    counts = np.bincount(y[rows], minlength=len(classes))
 
     # if all target values are the same (zero entropy), then return a tree with the target value
-    if entropy(df) == 0:
-        tree.attribute = df.columns[-1]
-        tree.value = df.iloc[0, -1]
+    # if there are no attributes left, then return a tree with the most common target
+    current_entropy = entropy_counts(counts)
+    if current_entropy == 0 or len(sorted_rows) == 0:
+        tree.attribute = target
+        tree.value = majority(classes, y[rows])
         return tree
-    
-    # if the dataframe does not have attributes (other than the target), then return a tree with the most common target
-    if len(df.columns) == 1:
-        tree.attribute = df.columns[-1]
-        target_column = df.iloc[: , -1]
-        target_counts = target_column.value_counts()
-        for i in target_counts.index:
-            if target_counts[i] == max(target_counts):
-                tree.value = i 
-                return tree 
-
-    # all other cases 
-    current_entropy = entropy(df)
+
+    # all other cases: evaluate every threshold of every attribute in one pass each
     best_info_gain = -1
     best_attribute = None
-    best_value = -1 
-    left_df = DataFrame()
-    right_df = DataFrame()
-    for candidate_attribute in df.columns[:-1]:
-        selection = df[candidate_attribute]
-        for candidate_value in selection.unique():
-            temp_left_df = DataFrame() 
-            temp_right_df = DataFrame() 
-            for _, row in df.iterrows():
-                value = row[candidate_attribute]
-                if value <= candidate_value:
-                    temp_left_df = temp_left_df.append(row, ignore_index=True)
-                else:
-                    temp_right_df = temp_right_df.append(row, ignore_index=True)
-
-            if len(temp_left_df.index) == 0 or len(temp_right_df.index) == 0:
-                continue
-
-            candidate_info_gain = current_entropy - entropy(temp_left_df) * len(temp_left_df.index) / len(df.index) - entropy(temp_right_df) * len(temp_right_df.index) / len(df.index)
-            if candidate_info_gain > best_info_gain:
-                best_attribute = candidate_attribute 
-                best_value = candidate_value
-                best_info_gain = candidate_info_gain
-                left_df = temp_left_df 
-                left_df = left_df.drop(columns=[candidate_attribute])
-                right_df = temp_right_df
-                right_df = right_df.drop(columns=[candidate_attribute])
-    
-    # if any of the split tree is empty, then return a tree with the most common target
-    if len(left_df.index) == 0 or len(right_df.index) == 0:
-        tree.attribute = df.columns[-1]
-        target_column = df.iloc[: , -1]
-        target_counts = target_column.value_counts()
-        for i in target_counts.index:
-            if target_counts[i] == max(target_counts):
-                tree.value = i 
-                return tree 
-
-    # recursive calls id3 to the left and to the right
-    tree.attribute = best_attribute 
-    tree.value = best_value
-    tree.left = id3(left_df)
-    tree.right = id3(right_df)
+    best_value = -1
+    for attribute, node_rows in sorted_rows.items():
+        split = best_split(X[node_rows, attribute], y[node_rows], node_rows, len(classes), current_entropy)
+        if split and split[0] > best_info_gain:
+            best_info_gain, best_value = split
+            best_attribute = attribute
+
+    # if no attribute splits the rows, then return a tree with the most common target
+    if best_attribute is None:
+        tree.attribute = target
+        tree.value = majority(classes, y[rows])
+        return tree
+
+    # partition every presorted list, which keeps the children sorted without re-sorting
+    goes_left = np.zeros(len(X), dtype=bool)
+    goes_left[rows] = X[rows, best_attribute] <= best_value
+    left_sorted, right_sorted = {}, {}
+    for attribute, node_rows in sorted_rows.items():
+        if attribute == best_attribute:
+            continue
+        mask = goes_left[node_rows]
+        left_sorted[attribute] = node_rows[mask]
+        right_sorted[attribute] = node_rows[~mask]
+    mask = goes_left[rows]
+
+    # recursive calls to the left and to the right
+    tree.attribute = columns[best_attribute]
+    tree.value = types[best_attribute](best_value)
+    tree.left = grow(X, y, classes, columns, types, rows[mask], left_sorted)
+    tree.right = grow(X, y, classes, columns, types, rows[~mask], right_sorted)
 
     # return the tree
     return tree
 
-if __name__ == "__main__":
+# computes a dedision tree given a data frame
+# assumes that the last column is the target
+def id3(df):
 
-    df = pd.read_csv(os.path.join(DATA_FOLDER, CSV_FILE_NAME))
-    runs = [ x for x in range(10, 21) ]
-    accuracies = []
+    # presort each attribute once into numpy arrays
+    X = df.iloc[:, :-1].to_numpy(dtype=float)
+    classes, y = np.unique(df.iloc[:, -1].to_numpy(), return_inverse=True)
+    order = np.argsort(X, axis=0, kind='stable')
+    sorted_rows = { attribute: order[:, attribute] for attribute in range(X.shape[1]) }
+
+    types = [ dtype.type for dtype in df.dtypes.iloc[:-1] ]
+    return grow(X, y, classes, df.columns, types, np.arange(len(df.index)), sorted_rows)
+
+# the data frame each worker process trains from (set once per worker by init_worker)
+worker_df = None
+worker_shm = None
+
+# attaches a worker to the shared copy of the data set instead of receiving it with every task
+def init_worker(shm_name, shape, columns):
+    global worker_df, worker_shm
+    worker_shm = shared_memory.SharedMemory(name=shm_name)
+    values = np.ndarray(shape, dtype=np.float64, buffer=worker_shm.buf)
+    worker_df = pd.DataFrame(values, columns=columns, copy=False)
 
-    for run in runs: 
+# trains and scores one tree on a random split; task is (training set %, repetition, seed)
+def run_experiment(task):
+    percentage, repetition, seed = task
 
-        print('run:', run)
+    # split the dataset into training and test dataset, selecting rows randomly and without repetition
+    rows = np.random.default_rng(seed).permutation(len(worker_df.index))
+    train_size = len(rows) * percentage // 100
+    train_df = worker_df.iloc[rows[:train_size]]
+    test_df = worker_df.iloc[rows[train_size:]]
 
-        # TODO: split the dataset into training and test dataset
-        # make sure you select data rows randomly and without repetition
-        random.seed(0)
+    start = time.perf_counter()
+    model = FlatTree.from_dtree(id3(train_df), worker_df.columns[:-1])
+    train_time = time.perf_counter() - start
 
-        # TODO: train a decision tree model (you can use the id3 function or scikit learn)
-        print('training...')
-        print('done!')
+    start = time.perf_counter()
+    predictions = model.predict_batch(test_df.iloc[:, :-1].to_numpy())
+    accuracy = float(np.mean(predictions == test_df.iloc[:, -1].to_numpy()))
+    test_time = time.perf_counter() - start
 
-        # TODO: (optional) print the obtained decision tree
+    return {
+        'percentage': percentage,
+        'repetition': repetition,
+        'accuracy': accuracy,
+        'nodes': len(model),
+        'train_time': train_time,
+        'test_time': test_time
+    }
 
-        # TODO: compute the accuracy of the obtained model using the test dataset
+# runs every (percentage, repetition) pair in a process pool and returns the results as a data frame
+# the data set is copied once into shared memory, so tasks only carry their parameters
+def learning_curve(df, percentages, repetitions=1, workers=None, seed=0):
+    values = df.to_numpy(dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    try:
+        np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+        pairs = [ (percentage, repetition) for percentage in percentages for repetition in range(repetitions) ]
+        tasks = [ (percentage, repetition, seed + i) for i, (percentage, repetition) in enumerate(pairs) ]
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(shm.name, values.shape, list(df.columns))) as pool:
+            results = list(pool.map(run_experiment, tasks))
+    finally:
+        shm.close()
+        shm.unlink()
+    return pd.DataFrame(results)
+
+if __name__ == "__main__":
+
+    df = read_csv_cached(os.path.join(DATA_FOLDER, CSV_FILE_NAME))
+    runs = [ x for x in range(10, 21) ]
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
 
+    # train a decision tree for every training set % (and repetition) in parallel
+    print('training...')
+    start = time.perf_counter()
+    results = learning_curve(df, runs, repetitions)
+    print('done!', f'({time.perf_counter() - start:.2f}s)')
+    print(results.to_string(index=False))
 
-    # TODO: plot learning curve
-    
+    # plot learning curve
+    accuracies = results.groupby('percentage')['accuracy'].mean()
+    plt.plot(accuracies.index, accuracies.values, marker='o')
     plt.xlabel('Training Set %')
     plt.ylabel('Model\'s Accuracy')
-    plt.show()
\ No newline at end of file
+    show('learning_curve')
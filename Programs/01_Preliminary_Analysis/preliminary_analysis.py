@@ -1,5 +1,7 @@
+from rendering import show
+
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from urllib.parse import urljoin
 import json
 import pandas as pd
@@ -13,15 +15,15 @@ title = f"Health Expenditure and Financing for {year}"
 x_label = f"Amount spent per capita\n(in 2010 international dollars)"
 
 # Retrieve page data as json
-response = requests.session().get(url)
-soup = BeautifulSoup(response.content, "html.parser")
+session = requests.session()
+response = session.get(url)
+soup = BeautifulSoup(response.content, "lxml", parse_only=SoupStrainer("link"))
 
 ## Data displayed on page is pulled from another location;
 ## Find the data location and retrieve its contents as json
 data_relative_link = soup.find("link", {"as": "fetch"})['href']
 data_url = urljoin(url, data_relative_link)
-response = requests.session().get(data_url).content
-raw_data = json.loads(BeautifulSoup(response, 'html.parser').string)
+raw_data = json.loads(session.get(data_url).content)
 
 # Ready information from json for use in DataFrame
 entities = raw_data['variables']['1871']['entities']
@@ -75,4 +77,4 @@ ax2.set(yticklabels=[])
 ax2.tick_params(left=False)
 ax2.set_title(title)
 
-plt.show()
\ No newline at end of file
+show('health_expenditure')
\ No newline at end of file
@@ -0,0 +1,181 @@
+import csv
+import io
+import os
+import sqlite3
+import zlib
+
+
+# Database backends shared by the load/export activities.
+# Each backend wraps one DB-API driver and exposes the same operations
+# (connect, bulk insert, streaming select, bulk export), so the scripts can
+# run against MySQL in production or a local SQLite file for testing.
+
+BATCH_SIZE = 10000
+
+
+class Backend:
+    name = ''
+    driver = None
+
+    # returns a new connection (transactions are committed explicitly)
+    def connect(self):
+        raise NotImplementedError
+
+    # converts a statement written with %s placeholders to the driver's style
+    def sql(self, statement):
+        return statement if self.driver.paramstyle != 'qmark' else statement.replace('%s', '?')
+
+    # errors caused by the rows themselves (bad values, duplicate keys)
+    def row_errors(self):
+        return self.driver.IntegrityError, self.driver.DataError, self.driver.ProgrammingError
+
+    # errors caused by the connection or the server (lost connection, locks)
+    def transient_errors(self):
+        return self.driver.OperationalError, self.driver.InterfaceError, self.driver.InternalError
+
+    # starts a transaction explicitly
+    def begin(self, db):
+        pass
+
+    # inserts a list of rows into table with one executemany call
+    # columns is the table's column count (default: the width of the first row); a row of
+    # another width then fails like any other bad row instead of shaping the statement
+    def insert_many(self, cursor, table, rows, columns=None):
+        if not rows:
+            return
+        placeholders = ', '.join(['%s'] * (columns or len(rows[0])))
+        cursor.executemany(self.sql(f"INSERT INTO {table} VALUES ({placeholders})"), rows)
+
+    # returns a cursor that fetches rows from the server as they are read
+    def streaming_cursor(self, db):
+        return db.cursor()
+
+    # yields the result of a select in lists of at most batch_size rows
+    def stream(self, db, statement, params=(), batch_size=BATCH_SIZE):
+        cursor = self.streaming_cursor(db)
+        try:
+            cursor.execute(self.sql(statement), params)
+            while batch := cursor.fetchmany(batch_size):
+                yield batch
+        finally:
+            cursor.close()
+
+    # writes the result of a select to a csv file (or any open text file) and returns the row count
+    def export_csv(self, db, statement, file, params=(), batch_size=BATCH_SIZE):
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, 'w', newline='') as csvfile:
+                return self.export_csv(db, statement, csvfile, params, batch_size)
+        writer = csv.writer(file, lineterminator='\n')
+        count = 0
+        for batch in self.stream(db, statement, params, batch_size):
+            writer.writerows(batch)
+            count += len(batch)
+        return count
+
+    # returns {bucket: (rows, checksum)} for the key ranges [bucket * width, (bucket + 1) * width)
+    # the checksum xors the crc32 of every row written as a csv line, so row order doesn't matter
+    def checksums(self, db, table, key, width, batch_size=BATCH_SIZE):
+        result = {}
+        line = io.StringIO()
+        writer = csv.writer(line, lineterminator='')
+        for batch in self.stream(db, f"SELECT {key}, {table}.* FROM {table}", batch_size=batch_size):
+            for row in batch:
+                line.seek(0)
+                line.truncate()
+                writer.writerow(row[1:])
+                bucket = row[0] // width
+                rows, checksum = result.get(bucket, (0, 0))
+                result[bucket] = (rows + 1, checksum ^ zlib.crc32(line.getvalue().encode('utf-8')))
+        return result
+
+    # returns the number of rows in a table
+    def count(self, db, table):
+        cursor = db.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        count = cursor.fetchone()[0]
+        cursor.close()
+        return count
+
+    # server-side bulk load of a csv file; returns the number of rows loaded
+    def load_file(self, db, table, filepath):
+        raise NotImplementedError(f"{self.name} backend has no bulk file load.")
+
+
+class MySQLBackend(Backend):
+    name = 'mysql'
+
+    def __init__(self, host, database, user, password, **options):
+        import mysql.connector
+        self.driver = mysql.connector
+        self.params = dict(host=host, database=database, user=user, password=password, **options)
+
+    def connect(self):
+        return self.driver.connect(autocommit=False, **self.params)
+
+    def begin(self, db):
+        if not db.in_transaction:
+            db.start_transaction()
+
+    # unbuffered: rows stay on the server until fetched
+    def streaming_cursor(self, db):
+        return db.cursor(buffered=False)
+
+    # same idea as Backend.checksums, computed by the server so no rows are transferred
+    def checksums(self, db, table, key, width, batch_size=BATCH_SIZE):
+        cursor = db.cursor()
+        cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+        # CONCAT_WS skips NULLs, so each one is written as \N to keep its position in the line
+        columns = ', '.join(f"COALESCE({description[0]}, '\\\\N')" for description in cursor.description)
+        cursor.fetchall()
+        cursor.execute(
+            f"SELECT {key} DIV {int(width)}, COUNT(*), BIT_XOR(CRC32(CONCAT_WS(',', {columns}))) "
+            f"FROM {table} GROUP BY 1"
+        )
+        result = {int(bucket): (rows, int(checksum)) for bucket, rows, checksum in cursor.fetchall()}
+        cursor.close()
+        return result
+
+    # LOAD DATA LOCAL INFILE; needs allow_local_infile=True and local_infile enabled on the server
+    # IGNORE turns duplicate keys into skipped rows
+    def load_file(self, db, table, filepath):
+        cursor = db.cursor()
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE {table} "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+            "LINES TERMINATED BY '\\n'",
+            (os.path.abspath(filepath),)
+        )
+        count = cursor.rowcount
+        db.commit()
+        cursor.close()
+        return count
+
+
+class SQLiteBackend(Backend):
+    name = 'sqlite'
+    driver = sqlite3
+
+    # schema is an optional script run on every connection (use CREATE TABLE IF NOT EXISTS)
+    def __init__(self, path, schema=None, timeout=30):
+        self.path = path
+        self.schema = schema
+        self.timeout = timeout
+
+    # connections may be handed between threads (e.g. by a connection pool)
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        if self.schema:
+            db.executescript(self.schema)
+        return db
+
+
+# returns the backend named by kind, or by the db_backend environment variable (default: mysql)
+# mysql uses host and database plus the db_user/db_pass environment variables;
+# sqlite uses the db_path environment variable (or path) as its database file
+def open_backend(kind=None, host='localhost', database=None, path=None, schema=None, **options):
+    kind = kind or os.getenv('db_backend', 'mysql')
+    if kind == 'mysql':
+        return MySQLBackend(host, database, os.getenv('db_user'), os.getenv('db_pass'), **options)
+    if kind == 'sqlite':
+        return SQLiteBackend(path or os.getenv('db_path', f"{database or 'data'}.sqlite3"), schema)
+    raise ValueError(f"Unknown db backend '{kind}'.")
@@ -1,5 +1,43 @@
 import os
 import json
+import hashlib
+import importlib
+import sqlite3
+import sys
+import threading
+import time
+
+
+# on-disk HTTP response cache shared by the API scripts (see cached_get)
+HTTP_CACHE_FILE = os.getenv('http_cache', os.path.join(os.path.expanduser('~'), '.cache', 'cs390z', 'http_cache.sqlite3'))
+HTTP_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+class LazyModule:
+    # Stands in for a module until one of its attributes is first used, and only
+    # then imports it, so scripts don't pay for heavy imports on paths that never use them
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'{' (loaded)' if self._module else ''}>"
+
+
+def lazy_import(name):
+    # Returns the module if it's already imported, otherwise a LazyModule for it
+    # e.g. plt = lazy_import('matplotlib.pyplot') instead of import matplotlib.pyplot as plt
+    # Setting the lazy_imports environment variable to 0 imports everything eagerly
+
+    if os.getenv('lazy_imports') == '0':
+        return importlib.import_module(name)
+    return sys.modules.get(name) or LazyModule(name)
 
 
 def file_exists(filepath, quit_message=None):
@@ -50,6 +88,335 @@ def json_write_to_file(data, filepath, indent=1):
         quit_msg("Failed to write to file", error)
 
 
+def file_hash(filepath, chunk_size=1 << 20):
+    # Returns the sha1 hex digest of a file, read in chunks
+
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_csv_cached(filepath, usecols=None, index_col=None, **kwargs):
+    # Reads a CSV file into a pandas DataFrame through a Parquet copy kept in a .cache
+    # folder next to it. The copy is rebuilt when the CSV changes: a different size or
+    # mtime triggers a hash check, and only a different hash triggers a rebuild.
+    # usecols only reads the listed columns from the cache. Other read_csv options,
+    # or a missing pyarrow, fall back to a plain pandas.read_csv.
+
+    import pandas
+
+    if kwargs:
+        return pandas.read_csv(filepath, usecols=usecols, index_col=index_col, **kwargs)
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return pandas.read_csv(filepath, usecols=usecols, index_col=index_col)
+
+    folder, name = os.path.split(filepath)
+    cache_folder = os.path.join(folder, '.cache')
+    cache_file = os.path.join(cache_folder, name + '.parquet')
+    meta_file = cache_file + '.json'
+
+    stat = os.stat(filepath)
+    meta = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    cached = None
+    if os.path.exists(meta_file) and os.path.exists(cache_file):
+        with open(meta_file) as file:
+            cached = json.load(file)
+
+    if cached and (cached['size'], cached['mtime']) != (meta['size'], meta['mtime']):
+        meta['hash'] = file_hash(filepath)
+        if cached.get('hash') != meta['hash']:
+            cached = None
+        else:
+            cached.update(meta)
+            json_write_to_file(cached, meta_file, indent=None)
+
+    if not cached:
+        data = pandas.read_csv(filepath)
+        try:
+            folder_exists(cache_folder)
+            data.to_parquet(cache_file + '.tmp', index=False)
+            os.replace(cache_file + '.tmp', cache_file)
+            meta['hash'] = meta.get('hash') or file_hash(filepath)
+            json_write_to_file(meta, meta_file, indent=None)
+        except Exception:
+            return data if usecols is None and index_col is None \
+                else pandas.read_csv(filepath, usecols=usecols, index_col=index_col)
+
+    # read only the requested columns, in file order (as read_csv does)
+    columns = None
+    if usecols is not None:
+        names = pyarrow.parquet.read_schema(cache_file).names
+        columns = [column for column in names if column in set(usecols)]
+    data = pandas.read_parquet(cache_file, columns=columns)
+
+    if index_col is not None:
+        data = data.set_index(data.columns[index_col] if isinstance(index_col, int) else index_col)
+    return data
+
+
+def jsonl_line_start(fd, end):
+    # Returns the offset of the line that ends at byte end - 1 of an open file
+    # (0 if no newline comes before it), reading back from end a block at a time
+
+    start = max(end - 1, 0)
+    while start > 0:
+        block_start = max(start - 4096, 0)
+        os.lseek(fd, block_start, os.SEEK_SET)
+        newline = os.read(fd, start - block_start).rfind(b'\n')
+        if newline >= 0:
+            return block_start + newline + 1
+        start = block_start
+    return 0
+
+
+def jsonl_append(record, filepath):
+    # Appends one record as a line to a JSON Lines file without reading the file.
+    # The line goes out in a single O_APPEND write followed by fsync, so a crash
+    # can leave at most a truncated last line, which jsonl_read skips. Such a torn
+    # line (the file doesn't end with a newline) is cut off before the next append,
+    # so the new record can't be merged into it.
+
+    line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+    try:
+        fd = os.open(filepath, os.O_RDWR | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        try:
+            size = os.lseek(fd, 0, os.SEEK_END)
+            if size:
+                os.lseek(fd, size - 1, os.SEEK_SET)
+                if os.read(fd, 1) != b'\n':
+                    os.ftruncate(fd, jsonl_line_start(fd, size))
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except Exception as error:
+        quit_msg("Failed to append to file.", error)
+
+
+def jsonl_read(filepath):
+    # Yields the records of a JSON Lines file one at a time
+    # Blank lines and a truncated last line (from an interrupted append) are skipped
+
+    if not file_exists(filepath):
+        return
+    with open(filepath, encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                if line.endswith('\n'):
+                    raise
+
+
+def jsonl_last(filepath):
+    # Returns the last record of a JSON Lines file (None if there is none), reading
+    # back from the end of the file instead of parsing every line; blank lines and a
+    # truncated last line are skipped, as in jsonl_read
+
+    if not file_exists(filepath):
+        return None
+    fd = os.open(filepath, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        end = os.lseek(fd, 0, os.SEEK_END)
+        while end > 0:
+            start = jsonl_line_start(fd, end)
+            os.lseek(fd, start, os.SEEK_SET)
+            line = os.read(fd, end - start)
+            if line.strip():
+                try:
+                    return json.loads(line)
+                except json.JSONDecodeError:
+                    if line.endswith(b'\n'):
+                        raise
+            end = start
+        return None
+    finally:
+        os.close(fd)
+
+
+def jsonl_compact(filepath, key):
+    # Rewrites a JSON Lines file keeping only the last record for each value of key
+    # (records keep the position of their first occurrence). The new file replaces
+    # the old one atomically. Returns the number of records kept.
+
+    records = {}
+    for record in jsonl_read(filepath):
+        records[record.get(key)] = record
+    temporary = filepath + '.tmp'
+    try:
+        with open(temporary, 'w', encoding='utf-8') as file:
+            for record in records.values():
+                file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, filepath)
+    except Exception as error:
+        quit_msg("Failed to compact file.", error)
+    return len(records)
+
+
+class HttpCache:
+    # Stores successful HTTP responses in a SQLite file, keyed by URL and query
+    # parameters (hashed, so API keys in the parameters aren't stored). Entries
+    # are fresh until their TTL runs out; stale entries keep their ETag and
+    # Last-Modified so they can be revalidated. The least recently used entries
+    # are evicted once the bodies add up to more than max_bytes.
+    # One cache can be shared by threads; its statements are serialized by a lock.
+
+    def __init__(self, filepath=HTTP_CACHE_FILE, max_bytes=HTTP_CACHE_MAX_BYTES):
+        folder_exists(os.path.dirname(filepath) or '.')
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(filepath, timeout=30, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                            key TEXT PRIMARY KEY, headers TEXT, content BLOB, size INTEGER,
+                            expires REAL, last_used REAL, etag TEXT, last_modified TEXT)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.db.commit()
+
+    @staticmethod
+    def key(url, params=None):
+        return hashlib.sha1(json.dumps([url, sorted((params or {}).items())], default=str).encode('utf-8')).hexdigest()
+
+    def lookup(self, url, params=None):
+        # Returns the cached entry as a dict (with 'fresh' set), or None
+        with self.lock:
+            row = self.db.execute("SELECT headers, content, expires, etag, last_modified FROM responses WHERE key = ?",
+                                  (self.key(url, params),)).fetchone()
+            if not row:
+                return None
+            self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), self.key(url, params)))
+            self.db.commit()
+        headers, content, expires, etag, last_modified = row
+        return {'headers': json.loads(headers), 'content': content, 'fresh': expires > time.time(),
+                'etag': etag, 'last_modified': last_modified}
+
+    def validators(self, entry):
+        # Returns the conditional request headers that revalidate a stale entry
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, params, headers, content, ttl):
+        # headers is any mapping; the validators are found whatever their case (etag, ETag, ...)
+        validators = {name.lower(): value for name, value in headers.items()}
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (self.key(url, params), json.dumps(dict(headers)), content, len(content), now + ttl, now,
+                             validators.get('etag'), validators.get('last-modified')))
+            self.db.commit()
+            self.evict()
+
+    def refresh(self, url, params, ttl):
+        # Marks an entry fresh again (after a 304 Not Modified)
+        with self.lock:
+            self.db.execute("UPDATE responses SET expires = ? WHERE key = ?", (time.time() + ttl, self.key(url, params)))
+            self.db.commit()
+
+    def evict(self):
+        with self.lock:
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+            self.db.commit()
+
+
+class CachedResponse:
+    # The parts of a requests.Response the scripts use, for responses served from the cache
+
+    def __init__(self, status_code, headers, content, from_cache):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def cached_get(url, params=None, ttl=3600, headers=None, cache=None, session=None):
+    # Like requests.get, but served from the HTTP cache while the cached copy is
+    # younger than ttl seconds. A stale copy is revalidated with ETag /
+    # Last-Modified, so an unchanged resource costs a 304 instead of a download.
+    # Only 200 responses are cached. A requests.Session reuses its pooled connections.
+
+    import requests
+
+    cache = cache or HttpCache()
+    entry = cache.lookup(url, params)
+    if entry and entry['fresh']:
+        return CachedResponse(200, entry['headers'], entry['content'], True)
+
+    response = (session or requests).get(url, params=params, headers={**(headers or {}), **cache.validators(entry)})
+    if response.status_code == 304 and entry:
+        cache.refresh(url, params, ttl)
+        return CachedResponse(200, entry['headers'], entry['content'], True)
+    if response.status_code == 200:
+        cache.store(url, params, response.headers, response.content, ttl)
+    return CachedResponse(response.status_code, dict(response.headers), response.content, False)
+
+
+def html_table(html, index=0, header=True, as_numpy=False):
+    # Extracts the index-th <table> of an HTML page into a pandas DataFrame (or, with
+    # as_numpy, a dict of column name -> NumPy array). The page is parsed by lxml when
+    # it's installed; otherwise by BeautifulSoup, building only the <table> elements
+    # (SoupStrainer). The first row gives the column names; a column whose cells all
+    # read as numbers once currency symbols, commas and percent signs are stripped
+    # becomes numeric (nullable Int64 if every value is whole).
+
+    import pandas
+    try:
+        import lxml.html
+        tables = list(lxml.html.fromstring(html).iter('table'))
+        cells = lambda table: [[' '.join(cell.text_content().split()) for cell in row if cell.tag in ('th', 'td')]
+                               for row in table.iter('tr')]
+    except ImportError:
+        from bs4 import BeautifulSoup, SoupStrainer
+        tables = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('table')).find_all('table')
+        cells = lambda table: [[cell.get_text(' ', strip=True) for cell in row.find_all(['th', 'td'])]
+                               for row in table.find_all('tr')]
+
+    if index >= len(tables):
+        raise ValueError(f"The page has {len(tables)} table(s); there is no table {index}.")
+    rows = [row for row in cells(tables[index]) if row]
+    width = max((len(row) for row in rows), default=0)
+    rows = [row + [''] * (width - len(row)) for row in rows]
+
+    columns = rows.pop(0) if header and rows else list(range(width))
+    data = pandas.DataFrame(rows, columns=columns)
+    for column in data.columns:
+        text = data[column]
+        numbers = pandas.to_numeric(text.str.replace(r'[$€£,%\s]', '', regex=True), errors='coerce')
+        if numbers.notna().sum() == (text != '').sum() and numbers.notna().any():
+            whole = numbers.dropna().mod(1).eq(0).all()
+            data[column] = numbers.astype('Int64') if whole else numbers
+        else:
+            data[column] = text.where(text != '', None)
+
+    if as_numpy:
+        return {column: data[column].to_numpy() for column in data.columns}
+    return data
+
+
 def print_array(array):
     for i in array:
         print(i)
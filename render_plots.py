@@ -0,0 +1,54 @@
+# Renders the figures of every plotting script in batch: each script runs headless in its own
+# process (see rendering.py), several at a time, and its figures are saved to the output folder.
+# Usage: render_plots.py [output folder] [workers]
+
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_FOLDER = 'plots'
+SCRIPTS = [
+    'Activities/11_Denver_Neighborhoods/src/similarity.py',
+    'Activities/12_Linear_Regression/src/linear_regression.py',
+    'Homework/03_HDI_Visualization/src/hdi_visualization.py',
+    'Homework/04_Denver_Neighborhoods/src/show_outliers.py',
+    'Homework/05_Global_Inequality_and_Education/src/linear_regression.py',
+    'Homework/06_Diabetes/src/id3_algorithm.py',
+    'Programs/01_Preliminary_Analysis/preliminary_analysis.py',
+]
+TIMEOUT = 1800
+
+
+# runs one script from its own folder (they read their data with relative paths)
+# returns (script, return code, seconds, last lines of stderr)
+def render(script, output):
+    env = dict(os.environ, plot_output=output,
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.getenv('PYTHONPATH')])))
+    path = os.path.join(ROOT, script)
+    start = time.perf_counter()
+    try:
+        result = subprocess.run([sys.executable, os.path.basename(path)], cwd=os.path.dirname(path),
+                                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=TIMEOUT)
+        code, errors = result.returncode, result.stderr
+    except subprocess.TimeoutExpired:
+        code, errors = None, f"timed out after {TIMEOUT}s"
+    return script, code, time.perf_counter() - start, errors.strip().splitlines()[-1:]
+
+
+if __name__ == "__main__":
+
+    output = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else OUTPUT_FOLDER)
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda script: render(script, output), SCRIPTS))
+
+    for script, code, seconds, errors in results:
+        status = 'ok' if code == 0 else 'FAILED'
+        print(f"{status:<8}{seconds:>8.2f}s  {script}", *(f"\n{'':<18}{line}" for line in errors if code != 0))
+    print(f"{len(os.listdir(output)) if os.path.exists(output) else 0} files in {output} "
+          f"({time.perf_counter() - start:.2f}s)")
@@ -0,0 +1,55 @@
+import os
+
+from helper_methods import lazy_import
+
+np = lazy_import('numpy')
+
+
+# Rendering shared by the plotting scripts.
+# Set the plot_output environment variable to run a script headless: matplotlib then uses
+# the Agg backend (no window, no GUI toolkit to start) and show() saves every open figure
+# to that folder instead of displaying it. plot_formats picks the file types (default: png).
+# Import this module before matplotlib.pyplot so the backend is chosen in time.
+
+OUTPUT_FOLDER = os.getenv('plot_output')
+FORMATS = os.getenv('plot_formats', 'png').split(',')
+MAX_SCATTER_POINTS = 100000     # above this, scatter() draws a 2d histogram instead of markers
+SCATTER_BINS = 300
+
+if OUTPUT_FOLDER:
+    os.environ['MPLBACKEND'] = 'Agg'
+
+
+# shows the open figures, or saves them as <name>.<format> (<name>_2.<format>, ... for
+# more than one figure) in the output folder when running headless; returns the files written
+def show(name):
+    import matplotlib.pyplot as plt
+    if not OUTPUT_FOLDER:
+        plt.show()
+        return []
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    files = []
+    for i, number in enumerate(plt.get_fignums()):
+        figure = plt.figure(number)
+        stem = name if i == 0 else f"{name}_{i + 1}"
+        for extension in FORMATS:
+            files.append(os.path.join(OUTPUT_FOLDER, f"{stem}.{extension}"))
+            figure.savefig(files[-1], bbox_inches='tight')
+        plt.close(figure)
+    return files
+
+
+# scatter plot whose drawing time doesn't grow with the data: up to max_points it is a
+# normal scatter, beyond that the points are counted into a bins x bins grid and the
+# non-empty cells are drawn with a log color scale
+def scatter(ax, x, y, max_points=MAX_SCATTER_POINTS, bins=SCATTER_BINS, **kwargs):
+    x = np.ravel(x)
+    y = np.ravel(y)
+    if len(x) <= max_points:
+        return ax.scatter(x, y, **kwargs)
+    from matplotlib.colors import LogNorm
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    mesh = ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts, 0).T,
+                         norm=LogNorm(), cmap=kwargs.get('cmap', 'viridis'), rasterized=True)
+    ax.figure.colorbar(mesh, ax=ax, label='points')
+    return mesh
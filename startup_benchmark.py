@@ -0,0 +1,88 @@
+# Measures the time-to-main of the scripts: interpreter startup plus everything their module level
+# imports, up to (not including) the __main__ block. Each script runs under -X importtime, with lazy
+# imports (see helper_methods.lazy_import) and with lazy_imports=0 to show what they save.
+# Usage: startup_benchmark.py [runs]
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = [
+    'Activities/01_CSV_Load/src/csv_load.py',
+    'Activities/02_CSV_Export/export_data.py',
+    'Activities/03_Quotes_Api/src/quotes_api.py',
+    'Activities/11_Denver_Neighborhoods/src/scraper.py',
+    'Activities/11_Denver_Neighborhoods/src/similarity.py',
+    'Activities/12_Linear_Regression/src/linear_regression.py',
+    'Homework/02_Weather_API/src/weather_api.py',
+    'Homework/03_HDI_Visualization/src/hdi_visualization.py',
+    'Homework/04_Denver_Neighborhoods/src/show_outliers.py',
+    'Homework/05_Global_Inequality_and_Education/src/linear_regression.py',
+    'Homework/06_Diabetes/src/id3_algorithm.py',
+]
+RUNS = 5
+TOP_IMPORTS = 3
+
+# runs the script's module level only: run_name isn't '__main__', so main() isn't called
+STARTUP = "import os, runpy, sys; os.chdir(sys.argv[1]); sys.argv = sys.argv[2:]; runpy.run_path(sys.argv[0], run_name='startup')"
+
+
+# one run of a script; returns (seconds, {top-level module: cumulative import microseconds})
+def time_to_main(script, lazy=True):
+    path = os.path.join(ROOT, script)
+    env = dict(os.environ, lazy_imports='1' if lazy else '0',
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.path.dirname(path), os.getenv('PYTHONPATH')])))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP, os.path.dirname(path), path],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return seconds, top_level_imports(result.stderr)
+
+
+# parses -X importtime output ("import time: self [us] | cumulative | package", nested packages indented)
+def top_level_imports(output):
+    imports = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, package = line.split('|')
+        if cumulative.strip().isdigit() and not package[1:].startswith(' '):
+            imports[package.strip()] = int(cumulative)
+    return imports
+
+
+# median time of runs runs, and the heaviest top-level imports of the last run
+def measure(script, runs, lazy=True):
+    times = []
+    for _ in range(runs):
+        seconds, imports = time_to_main(script, lazy)
+        times.append(seconds)
+    heaviest = sorted(imports.items(), key=lambda item: -item[1])[:TOP_IMPORTS]
+    return statistics.median(times), heaviest
+
+
+if __name__ == "__main__":
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        subprocess.run([sys.executable, '-c', 'pass'])
+    baseline = (time.perf_counter() - start) / runs
+    print(f"interpreter startup: {baseline * 1000:.0f} ms (median of {runs} runs below)")
+    print(f"{'script':<70}{'lazy ms':>9}{'eager ms':>10}  heaviest imports (lazy, ms)")
+
+    for script in SCRIPTS:
+        try:
+            lazy, heaviest = measure(script, runs)
+            eager, _ = measure(script, runs, lazy=False)
+        except RuntimeError as error:
+            print(f"{script:<70}  failed: {error}")
+            continue
+        imports = ', '.join(f"{package} {microseconds / 1000:.0f}" for package, microseconds in heaviest)
+        print(f"{script:<70}{lazy * 1000:>9.0f}{eager * 1000:>10.0f}  {imports}")